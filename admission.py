@@ -0,0 +1,54 @@
+# --- Ограничение одновременных запросов к боту ---
+# Каждый запрос, который ждёт ответа бота, держит поток Flask (или соединение) до
+# SEND_TIMEOUT + RESPONSE_TIMEOUT секунд. Когда бот медленный, такие запросы копятся,
+# пока не кончатся потоки. Поэтому одновременно ждущих запросов не больше max_in_flight,
+# а от одного клиента - не больше max_per_client; лишние сразу получают 503 с
+# Retry-After. Запросы, которые отдаются из кэша, не ограничиваются.
+
+import threading
+
+
+class Overloaded(Exception):
+    """Запрос не принят из-за перегрузки; клиенту стоит повторить через retry_after секунд."""
+
+    def __init__(self, message, retry_after, reason):
+        super().__init__(message)
+        self.message = message
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class AdmissionControl:
+    """max_in_flight / max_per_client = 0 - без ограничения."""
+
+    def __init__(self, max_in_flight, max_per_client, retry_after):
+        self.max_in_flight = max_in_flight
+        self.max_per_client = max_per_client
+        self.retry_after = retry_after
+        self.in_flight = 0
+        self._per_client = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, client):
+        with self._lock:
+            if self.max_in_flight and self.in_flight >= self.max_in_flight:
+                raise Overloaded("Сервер перегружен, повторите запрос позже", self.retry_after, "in_flight")
+            client_count = self._per_client.get(client, 0)
+            if self.max_per_client and client_count >= self.max_per_client:
+                raise Overloaded("Слишком много одновременных запросов от клиента", self.retry_after, "per_client")
+            self.in_flight += 1
+            self._per_client[client] = client_count + 1
+
+    def release(self, client):
+        with self._lock:
+            self.in_flight -= 1
+            client_count = self._per_client.get(client, 0) - 1
+            if client_count > 0:
+                self._per_client[client] = client_count
+            else:
+                self._per_client.pop(client, None)
+
+    def stats(self):
+        with self._lock:
+            return {"in_flight": self.in_flight, "max_in_flight": self.max_in_flight,
+                    "max_per_client": self.max_per_client, "clients": dict(self._per_client)}
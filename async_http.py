@@ -0,0 +1,140 @@
+# --- Асинхронный HTTP-сервер в цикле событий Telegram ---
+# В режиме HTTP_SERVER=async /synthesize/ обслуживается корутиной aiohttp прямо в
+# цикле событий Pyrogram: ожидание ответа бота - это asyncio.Future, а не поток,
+# заблокированный на threading.Event. Остальные (служебные) маршруты Flask
+# обслуживаются через WSGI-мост в пуле потоков, чтобы не дублировать их код.
+
+import io
+import sys
+import asyncio
+import logging
+from urllib.parse import unquote_to_bytes
+
+logger = logging.getLogger("AsyncHTTP")
+
+try:
+    from aiohttp import web
+    AIOHTTP_AVAILABLE = True
+except ImportError:
+    web = None
+    AIOHTTP_AVAILABLE = False
+
+
+def _build_environ(request, body):
+    environ = {
+        "REQUEST_METHOD": request.method,
+        "SCRIPT_NAME": "",
+        # PATH_INFO в WSGI - это байты пути, раскодированные как latin-1
+        "PATH_INFO": unquote_to_bytes(request.rel_url.raw_path).decode("latin-1"),
+        "QUERY_STRING": request.rel_url.raw_query_string,
+        "SERVER_NAME": request.host.split(":")[0],
+        "SERVER_PORT": str(request.url.port or 80),
+        "SERVER_PROTOCOL": f"HTTP/{request.version.major}.{request.version.minor}",
+        "REMOTE_ADDR": request.remote or "",
+        "CONTENT_TYPE": request.headers.get("Content-Type", ""),
+        "CONTENT_LENGTH": str(len(body)),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": request.scheme,
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+    }
+    for name, value in request.headers.items():
+        key = "HTTP_" + name.upper().replace("-", "_")
+        if key not in ("HTTP_CONTENT_TYPE", "HTTP_CONTENT_LENGTH"):
+            environ[key] = value
+    return environ
+
+
+def _call_wsgi(wsgi_app, environ):
+    status_headers = {}
+
+    def start_response(status, headers, exc_info=None):
+        status_headers["status"] = int(status.split(" ", 1)[0])
+        status_headers["headers"] = headers
+
+    chunks = wsgi_app(environ, start_response)
+    try:
+        body = b"".join(chunks)
+    finally:
+        if hasattr(chunks, "close"):
+            chunks.close()
+    return status_headers["status"], status_headers["headers"], body
+
+
+def wsgi_bridge(wsgi_app):
+    """Обработчик aiohttp, который выполняет запрос WSGI-приложением в пуле потоков."""
+    async def handler(request):
+        body = await request.read()
+        environ = _build_environ(request, body)
+        loop = asyncio.get_running_loop()
+        status, headers, response_body = await loop.run_in_executor(None, _call_wsgi, wsgi_app, environ)
+        response = web.Response(status=status, body=response_body)
+        for name, value in headers:
+            if name.lower() not in ("content-length", "transfer-encoding", "connection"):
+                response.headers.add(name, value)
+        return response
+    return handler
+
+
+async def start_server(routes, host, port, fallback_wsgi_app=None, middlewares=()):
+    """
+    Запускает aiohttp в текущем цикле событий. routes - список web.route(...);
+    всё, что не совпало, уходит во fallback_wsgi_app. Возвращает AppRunner.
+    """
+    http_app = web.Application(middlewares=list(middlewares))
+    http_app.add_routes(routes)
+    if fallback_wsgi_app is not None:
+        http_app.router.add_route("*", "/{tail:.*}", wsgi_bridge(fallback_wsgi_app))
+    runner = web.AppRunner(http_app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"Асинхронный HTTP сервер запущен на http://{host}:{port}")
+    return runner
+
+
+async def stream_response(request, chunks, content_type):
+    """
+    Отдаёт куски из синхронного генератора chunks ответом с chunked-кодированием.
+    Следующий кусок берётся в пуле потоков - генератор может конвертировать аудио.
+    """
+    response = web.StreamResponse(headers={"Content-Type": content_type})
+    response.enable_chunked_encoding()
+    await response.prepare(request)
+    loop = asyncio.get_running_loop()
+    iterator = iter(chunks)
+    try:
+        while True:
+            chunk = await loop.run_in_executor(None, next, iterator, None)
+            if chunk is None:
+                break
+            await response.write(chunk)
+    except Exception as e:
+        # Заголовки уже отправлены: обрываем соединение, чтобы клиент не принял
+        # обрезанный ответ за целый
+        logger.error(f"Ошибка во время потоковой отдачи: {e}")
+        if request.transport is not None:
+            request.transport.close()
+        return response
+    await response.write_eof()
+    return response
+
+
+async def event_stream_response(request, events):
+    """Поток Server-Sent Events: events - асинхронный итератор готовых строк событий."""
+    response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+    await response.prepare(request)
+    try:
+        async for event in events:
+            await response.write(event.encode("utf-8"))
+    except (ConnectionResetError, asyncio.CancelledError):
+        # Клиент отключился
+        return response
+    finally:
+        # Генератор событий отписывается от источника сразу, а не при сборке мусора
+        if hasattr(events, "aclose"):
+            await events.aclose()
+    await response.write_eof()
+    return response
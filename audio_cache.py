@@ -0,0 +1,199 @@
+# --- Кэш синтезированного аудио ---
+# Двухуровневый кэш: LRU в памяти + файлы на диске с вытеснением по суммарному размеру.
+# Ключ - хэш нормализованного текста (после num2words и Mystem), формата вывода и голоса,
+# поэтому одинаковые фразы не отправляются боту повторно и переживают перезапуск.
+
+import os
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger("AudioCache")
+
+
+def make_cache_key(text, audio_format, voice=None):
+    """Возвращает ключ кэша для нормализованного текста, формата аудио и голоса (None - голос чата по умолчанию)."""
+    payload = f"{audio_format}\n{voice}\n{text}" if voice else f"{audio_format}\n{text}"
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class AudioCache:
+    def __init__(self, cache_dir, memory_max_bytes, disk_max_bytes):
+        self.cache_dir = cache_dir
+        self.memory_max_bytes = memory_max_bytes
+        self.disk_max_bytes = disk_max_bytes
+
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()   # key -> bytes, в порядке последнего использования
+        self._memory_bytes = 0
+        self._disk = OrderedDict()     # key -> размер файла, в порядке последнего использования
+        self._disk_bytes = 0
+
+        self.hits_memory = 0
+        self.hits_disk = 0
+        self.misses = 0
+        self.evictions_memory = 0
+        self.evictions_disk = 0
+
+        if self.disk_max_bytes > 0:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            self._load_disk_index()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.bin")
+
+    def _load_disk_index(self):
+        """Восстанавливает индекс дискового уровня после перезапуска (старые файлы - первыми)."""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".bin"):
+                continue
+            try:
+                st = os.stat(os.path.join(self.cache_dir, name))
+            except OSError:
+                continue
+            entries.append((st.st_mtime, name[:-4], st.st_size))
+        entries.sort()
+        for _, key, size in entries:
+            self._disk[key] = size
+            self._disk_bytes += size
+        logger.info(f"Дисковый кэш аудио: {len(self._disk)} файлов, {self._disk_bytes / 1024 / 1024:.1f} МБ.")
+        self._evict_disk()
+
+    def get(self, key):
+        """Возвращает байты аудио или None, если в кэше ничего нет."""
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                self.hits_memory += 1
+                return data
+            on_disk = key in self._disk
+
+        if on_disk:
+            try:
+                with open(self._path(key), "rb") as f:
+                    data = f.read()
+                os.utime(self._path(key))
+            except OSError as e:
+                logger.warning(f"Не удалось прочитать файл кэша {key}: {e}")
+                with self._lock:
+                    size = self._disk.pop(key, None)
+                    if size is not None:
+                        self._disk_bytes -= size
+                    self.misses += 1
+                return None
+            with self._lock:
+                if key in self._disk:
+                    self._disk.move_to_end(key)
+                self.hits_disk += 1
+                self._put_memory(key, data)
+            return data
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, data):
+        """Сохраняет аудио в оба уровня кэша."""
+        if not data:
+            return
+        with self._lock:
+            self._put_memory(key, data)
+            if self.disk_max_bytes <= 0 or len(data) > self.disk_max_bytes or key in self._disk:
+                return
+
+        path = self._path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Не удалось записать файл кэша {key}: {e}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return
+
+        with self._lock:
+            if key not in self._disk:
+                self._disk[key] = len(data)
+                self._disk_bytes += len(data)
+            self._evict_disk()
+
+    def _put_memory(self, key, data):
+        # Вызывается под self._lock
+        if self.memory_max_bytes <= 0 or len(data) > self.memory_max_bytes:
+            return
+        old = self._memory.pop(key, None)
+        if old is not None:
+            self._memory_bytes -= len(old)
+        self._memory[key] = data
+        self._memory_bytes += len(data)
+        while self._memory_bytes > self.memory_max_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+            self.evictions_memory += 1
+
+    def _evict_disk(self):
+        # Вызывается под self._lock (или при инициализации)
+        while self._disk_bytes > self.disk_max_bytes and self._disk:
+            key, size = self._disk.popitem(last=False)
+            self._disk_bytes -= size
+            self.evictions_disk += 1
+            try:
+                os.remove(self._path(key))
+            except OSError as e:
+                logger.warning(f"Не удалось удалить файл кэша {key}: {e}")
+
+    def stats(self):
+        """Счётчики попаданий/промахов/вытеснений и текущий размер уровней."""
+        with self._lock:
+            return {
+                "hits_memory": self.hits_memory,
+                "hits_disk": self.hits_disk,
+                "misses": self.misses,
+                "evictions_memory": self.evictions_memory,
+                "evictions_disk": self.evictions_disk,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "memory_max_bytes": self.memory_max_bytes,
+                "disk_entries": len(self._disk),
+                "disk_bytes": self._disk_bytes,
+                "disk_max_bytes": self.disk_max_bytes,
+            }
+
+
+class VoiceIndex:
+    """
+    file_unique_id голосового бота -> (нормализованный текст, голос), под которыми OGG
+    этого файла лежит в кэше. Бот отвечает тем же файлом на повторяющийся текст, и по
+    индексу его аудио берётся из кэша без скачивания и конвертации. Хранится в
+    памяти, не больше max_entries последних файлов.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, file_unique_id):
+        with self._lock:
+            entry = self._entries.get(file_unique_id)
+            if entry is not None:
+                self._entries.move_to_end(file_unique_id)
+            return entry
+
+    def put(self, file_unique_id, text, voice=None):
+        with self._lock:
+            self._entries[file_unique_id] = (text, voice)
+            self._entries.move_to_end(file_unique_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
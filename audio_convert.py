@@ -0,0 +1,368 @@
+# --- Конвертация голосовых сообщений OGG/Opus -> WAV / PCM ---
+# Основной путь работает целиком в памяти: Opus декодируется в процессе (PyAV) в
+# массив NumPy, частота меняется векторной интерполяцией, а заголовок WAV и PCM
+# пишутся сразу в итоговый буфер - без временных файлов и без запуска ffmpeg.
+# Если PyAV/NumPy не установлены или декодирование не удалось, используется
+# прежний путь через pydub + ffmpeg.
+# stream_audio() отдаёт тот же результат кусками по мере декодирования - для
+# потоковой выдачи клиенту без сборки всего файла и без base64.
+
+import io
+import struct
+import asyncio
+import logging
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from pydub import AudioSegment
+
+logger = logging.getLogger("AudioConvert")
+
+try:
+    import av
+    import numpy as np
+    FAST_DECODE_AVAILABLE = True
+except ImportError:
+    FAST_DECODE_AVAILABLE = False
+    logger.warning("PyAV/NumPy не установлены, конвертация аудио пойдёт через ffmpeg.")
+
+WAV_HEADER_SIZE = 44
+
+CONTAINERS = ("wav", "pcm", "ogg")
+SAMPLE_WIDTHS = (1, 2)
+MIN_SAMPLE_RATE = 8000
+MAX_SAMPLE_RATE = 192000
+
+# Размер куска при потоковой выдаче
+STREAM_CHUNK_BYTES = 64 * 1024
+# Длина данных в заголовке WAV, пока она неизвестна (поток): RIFF-размер = 0xFFFFFFFF
+STREAM_DATA_SIZE = 0xFFFFFFFF - 36
+
+
+class AudioFormat(namedtuple("AudioFormat", "container sample_rate sample_width")):
+    """
+    Формат ответа: контейнер (wav, pcm - сырой PCM, ogg - голосовое сообщение бота
+    без декодирования), частота дискретизации и размер сэмпла в байтах. Всегда моно.
+    """
+    __slots__ = ()
+
+    @property
+    def key(self):
+        """Строка формата для ключа кэша, например "wav-128000-s16-mono"."""
+        if self.container == "ogg":
+            return "ogg"
+        sample_type = "s16" if self.sample_width == 2 else "u8"
+        return f"{self.container}-{self.sample_rate}-{sample_type}-mono"
+
+    @property
+    def mimetype(self):
+        if self.container == "wav":
+            return "audio/wav"
+        if self.container == "ogg":
+            return "audio/ogg"
+        if self.sample_width == 2:
+            return f"audio/L16;rate={self.sample_rate};channels=1"
+        return "application/octet-stream"
+
+    def with_options(self, container=None, sample_rate=None, sample_width=None):
+        """Возвращает формат с переопределёнными параметрами; неверные значения -> ValueError."""
+        container = (container or self.container).lower()
+        sample_rate = _parse_positive_int(sample_rate, "Частота дискретизации") if sample_rate else self.sample_rate
+        sample_width = _parse_positive_int(sample_width, "Размер сэмпла") if sample_width else self.sample_width
+        if sample_width in (8, 16):
+            sample_width //= 8
+        if container not in CONTAINERS:
+            raise ValueError(f"Неизвестный формат '{container}', допустимы: {', '.join(CONTAINERS)}")
+        if not MIN_SAMPLE_RATE <= sample_rate <= MAX_SAMPLE_RATE:
+            raise ValueError(f"Частота дискретизации должна быть от {MIN_SAMPLE_RATE} до {MAX_SAMPLE_RATE} Гц")
+        if sample_width not in SAMPLE_WIDTHS:
+            raise ValueError("Размер сэмпла должен быть 8 или 16 бит")
+        return AudioFormat(container, sample_rate, sample_width)
+
+
+def _parse_positive_int(value, name):
+    """Целое положительное число из параметра запроса; иначе ValueError с понятным текстом."""
+    try:
+        number = int(str(value).strip())
+    except ValueError:
+        raise ValueError(f"{name}: ожидается целое число, получено '{value}'") from None
+    if number <= 0:
+        raise ValueError(f"{name}: ожидается положительное число, получено {number}")
+    return number
+
+
+OGG_PASSTHROUGH = AudioFormat("ogg", 48000, 2)
+
+
+def decode_ogg(ogg_bytes):
+    """Декодирует OGG/Opus в моно float32 [-1, 1]. Возвращает (samples, sample_rate)."""
+    chunks = []
+    sample_rate = None
+    with av.open(io.BytesIO(ogg_bytes), format="ogg") as container:
+        stream = container.streams.audio[0]
+        for frame in container.decode(stream):
+            sample_rate = frame.sample_rate
+            data = frame.to_ndarray()
+            if not frame.format.is_planar:
+                # Упакованный формат: (1, samples * channels) -> (channels, samples)
+                data = data.reshape(-1, len(frame.layout.channels)).T
+            if data.dtype.kind in "iu":
+                data = data.astype(np.float32) / np.iinfo(data.dtype).max
+            chunks.append(data.mean(axis=0, dtype=np.float32) if data.shape[0] > 1 else data[0].astype(np.float32, copy=False))
+    if not chunks:
+        raise ValueError("В голосовом сообщении нет аудиоданных")
+    return np.concatenate(chunks), sample_rate
+
+
+def resample(samples, src_rate, dst_rate):
+    """Линейная интерполяция (как audioop.ratecv в pydub), векторно."""
+    if src_rate == dst_rate or len(samples) == 0:
+        return samples
+    dst_length = int(round(len(samples) * dst_rate / src_rate))
+    positions = np.arange(dst_length, dtype=np.float64) * (src_rate / dst_rate)
+    return np.interp(positions, np.arange(len(samples)), samples).astype(np.float32)
+
+
+def write_wav_header(buffer, data_size, sample_rate, sample_width=2, channels=1):
+    """Пишет 44-байтовый заголовок PCM WAV в начало buffer."""
+    block_align = channels * sample_width
+    struct.pack_into("<4sI4s4sIHHIIHH4sI", buffer, 0,
+                     b"RIFF", 36 + data_size, b"WAVE",
+                     b"fmt ", 16, 1, channels, sample_rate, sample_rate * block_align, block_align, sample_width * 8,
+                     b"data", data_size)
+
+
+def encode_samples(samples, audio_format):
+    """
+    float32 моно -> PCM (8 бит без знака или 16 бит со знаком). Для WAV перед PCM
+    оставляется место под заголовок; PCM пишется прямо в итоговый буфер.
+    """
+    header_size = WAV_HEADER_SIZE if audio_format.container == "wav" else 0
+    data_size = len(samples) * audio_format.sample_width
+    buffer = bytearray(header_size + data_size)
+    if header_size:
+        write_wav_header(buffer, data_size, audio_format.sample_rate, audio_format.sample_width)
+    if audio_format.sample_width == 2:
+        pcm = np.frombuffer(buffer, dtype="<i2", offset=header_size)
+        np.clip(np.rint(samples * 32767.0), -32768, 32767, out=samples)
+    else:
+        pcm = np.frombuffer(buffer, dtype="u1", offset=header_size)
+        np.clip(np.rint(samples * 127.0) + 128.0, 0, 255, out=samples)
+    pcm[:] = samples
+    return bytes(buffer)
+
+
+def convert_audio_fast(ogg_bytes, audio_format):
+    samples, src_rate = decode_ogg(ogg_bytes)
+    samples = resample(samples, src_rate, audio_format.sample_rate)
+    return encode_samples(samples, audio_format)
+
+
+def convert_audio_ffmpeg(ogg_bytes, audio_format):
+    audio = AudioSegment.from_file(io.BytesIO(ogg_bytes), format="ogg")
+    standard_audio = (audio.set_frame_rate(audio_format.sample_rate)
+                      .set_sample_width(audio_format.sample_width)
+                      .set_channels(1))
+    if audio_format.container == "pcm":
+        return standard_audio.raw_data
+    output = io.BytesIO()
+    standard_audio.export(output, format="wav")
+    return output.getvalue()
+
+
+def convert_audio(ogg_bytes, audio_format):
+    """Конвертирует OGG/Opus из бота в заданный формат; OGG отдаётся как есть, без декодирования."""
+    if audio_format.container == "ogg":
+        return ogg_bytes
+    if FAST_DECODE_AVAILABLE:
+        try:
+            return convert_audio_fast(ogg_bytes, audio_format)
+        except Exception as e:
+            logger.warning(f"Ошибка конвертации в памяти ({e}), используется ffmpeg.")
+    return convert_audio_ffmpeg(ogg_bytes, audio_format)
+
+
+def iter_chunks(data, chunk_size=STREAM_CHUNK_BYTES):
+    """
+    Отдаёт готовые байты кусками. Куски - bytes: WSGI-сервер (Werkzeug) принимает
+    только их, memoryview прерывает ответ. Копируется по одному куску за раз.
+    """
+    view = memoryview(data)
+    for start in range(0, len(view), chunk_size):
+        yield bytes(view[start:start + chunk_size])
+
+
+class StreamResampler:
+    """
+    Линейная интерполяция, как resample(), но по кускам: между вызовами
+    сохраняются позиция и последний отсчёт, поэтому стыки кусков не щёлкают.
+    """
+
+    def __init__(self, src_rate, dst_rate):
+        self.step = src_rate / dst_rate
+        self.position = 0.0   # следующая позиция вывода в отсчётах входа
+        self.offset = 0       # номер первого отсчёта в self.tail
+        self.tail = np.zeros(0, dtype=np.float32)
+
+    def feed(self, samples):
+        buffer = np.concatenate((self.tail, samples))
+        last = self.offset + len(buffer) - 1
+        if len(buffer) == 0 or self.position > last:
+            self.tail = buffer
+            return np.zeros(0, dtype=np.float32)
+        count = int((last - self.position) // self.step) + 1
+        positions = self.position - self.offset + np.arange(count, dtype=np.float64) * self.step
+        output = np.interp(positions, np.arange(len(buffer)), buffer).astype(np.float32)
+        self.position += count * self.step
+        keep_from = min(int(self.position) - self.offset, len(buffer) - 1)
+        self.tail = buffer[keep_from:]
+        self.offset += keep_from
+        return output
+
+
+def stream_convert_fast(ogg_bytes, audio_format, chunk_size=STREAM_CHUNK_BYTES):
+    """Декодирует OGG/Opus покадрово и отдаёт PCM (для WAV - после заголовка) кусками."""
+    pcm_format = audio_format._replace(container="pcm")
+    chunk_samples = max(1, chunk_size // audio_format.sample_width)
+    if audio_format.container == "wav":
+        header = bytearray(WAV_HEADER_SIZE)
+        write_wav_header(header, STREAM_DATA_SIZE, audio_format.sample_rate, audio_format.sample_width)
+        yield bytes(header)
+
+    resampler = None
+    pending = []
+    pending_length = 0
+    with av.open(io.BytesIO(ogg_bytes), format="ogg") as container:
+        stream = container.streams.audio[0]
+        for frame in container.decode(stream):
+            if resampler is None:
+                resampler = StreamResampler(frame.sample_rate, audio_format.sample_rate)
+            data = frame.to_ndarray()
+            if not frame.format.is_planar:
+                data = data.reshape(-1, len(frame.layout.channels)).T
+            if data.dtype.kind in "iu":
+                data = data.astype(np.float32) / np.iinfo(data.dtype).max
+            samples = data.mean(axis=0, dtype=np.float32) if data.shape[0] > 1 else data[0].astype(np.float32)
+            samples = resampler.feed(samples)
+            pending.append(samples)
+            pending_length += len(samples)
+            if pending_length >= chunk_samples:
+                yield encode_samples(np.concatenate(pending), pcm_format)
+                pending = []
+                pending_length = 0
+    if resampler is None:
+        raise ValueError("В голосовом сообщении нет аудиоданных")
+    if pending_length:
+        yield encode_samples(np.concatenate(pending), pcm_format)
+
+
+def stream_audio(ogg_bytes, audio_format, chunk_size=STREAM_CHUNK_BYTES):
+    """
+    Как convert_audio, но генератор кусков. Заголовок WAV идёт первым с длиной
+    STREAM_DATA_SIZE (длина заранее неизвестна); для кэша используйте join_stream().
+    Если быстрый путь упал до первого куска, используется ffmpeg.
+    """
+    if audio_format.container == "ogg":
+        yield from iter_chunks(ogg_bytes, chunk_size)
+        return
+    if FAST_DECODE_AVAILABLE:
+        started = False
+        try:
+            for chunk in stream_convert_fast(ogg_bytes, audio_format, chunk_size):
+                started = True
+                yield chunk
+            return
+        except Exception as e:
+            if started:
+                raise
+            logger.warning(f"Ошибка потоковой конвертации ({e}), используется ffmpeg.")
+    yield from iter_chunks(convert_audio_ffmpeg(ogg_bytes, audio_format), chunk_size)
+
+
+def join_stream(chunks, audio_format):
+    """Собирает куски stream_audio() в цельный файл с правильной длиной в заголовке WAV."""
+    data = bytearray(b"".join(chunks))
+    if audio_format.container == "wav" and len(data) >= WAV_HEADER_SIZE:
+        write_wav_header(data, len(data) - WAV_HEADER_SIZE, audio_format.sample_rate, audio_format.sample_width)
+    return bytes(data)
+
+
+def pcm_data(audio_data, audio_format):
+    """PCM-данные без заголовка: для WAV ищется чанк data (заголовок pydub/ffmpeg может быть длиннее 44 байт)."""
+    view = memoryview(audio_data)
+    if audio_format.container != "wav":
+        return view
+    data_pos = bytes(view[12:256]).find(b"data")
+    if data_pos < 0:
+        return view[WAV_HEADER_SIZE:]
+    start = 12 + data_pos + 8
+    data_size = struct.unpack_from("<I", view, start - 4)[0]
+    return view[start:start + data_size]
+
+
+def concat_audio(parts, audio_format, silence_ms=0):
+    """Склеивает WAV/PCM одного формата в один файл, вставляя silence_ms тишины между кусками."""
+    if len(parts) == 1:
+        return parts[0]
+    silence_byte = b"\x80" if audio_format.sample_width == 1 else b"\x00"
+    silence = silence_byte * (audio_format.sample_rate * silence_ms // 1000 * audio_format.sample_width)
+    pcm = silence.join(pcm_data(part, audio_format) for part in parts)
+    if audio_format.container != "wav":
+        return pcm
+    data = bytearray(WAV_HEADER_SIZE) + pcm
+    write_wav_header(data, len(pcm), audio_format.sample_rate, audio_format.sample_width)
+    return bytes(data)
+
+
+class ConversionQueueFull(Exception):
+    """Задача конвертации не принята: ждущих семафора уже max_waiting."""
+
+
+class ConversionPool:
+    """
+    Выполняет конвертацию в пуле потоков, чтобы она не блокировала цикл событий
+    Pyrogram (отправку сообщений, другие ответы бота, PING/PONG Twitch).
+    Декодирование PyAV, NumPy и ffmpeg отпускают GIL, поэтому потоков достаточно.
+    max_concurrent - ограничение одновременных задач (в пуле и в очереди исполнителя);
+    задачи сверх него ждут семафора (waiting). Ждущих не больше max_waiting (0 - без
+    ограничения), следующие сразу получают ConversionQueueFull: допуск запросов не
+    ограничивает всех, кто конвертирует (опоздавшие ответы бота, прогрев кэша).
+    """
+
+    def __init__(self, workers, max_concurrent, max_waiting=0):
+        self.workers = workers
+        self.max_concurrent = max_concurrent
+        self.max_waiting = max_waiting
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="AudioWorker")
+        self._semaphore = None
+        self.in_progress = 0
+        self.waiting = 0
+        self.rejected = 0
+
+    async def convert(self, ogg_bytes, audio_format):
+        if self._semaphore is None:
+            # Семафор создаётся внутри работающего цикла событий
+            self._semaphore = asyncio.Semaphore(self.max_concurrent)
+        if self.max_waiting and self._semaphore.locked() and self.waiting >= self.max_waiting:
+            self.rejected += 1
+            raise ConversionQueueFull(f"Очередь конвертации заполнена ({self.waiting} задач ждут)")
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.in_progress += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, convert_audio, ogg_bytes, audio_format)
+        finally:
+            self.in_progress -= 1
+            self._semaphore.release()
+
+    def stats(self):
+        return {"workers": self.workers, "max_concurrent": self.max_concurrent,
+                "max_waiting": self.max_waiting, "in_progress": self.in_progress,
+                "waiting": self.waiting, "rejected": self.rejected}
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
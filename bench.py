@@ -0,0 +1,253 @@
+# --- Микробенчмарки этапов обработки ---
+# Замеряет по отдельности этапы, которые в сервере выполняются внутри обработчиков
+# запросов: замену чисел словами, коррекцию рода числительных, конвертацию
+# OGG -> WAV/PCM (в памяти и через ffmpeg) и base64. Тексты берутся из
+# data/bench_corpus.txt, голосовые - из файлов --ogg или собираются mock_bot.py
+# (тишина 1, 5 и 20 секунд), поэтому результаты воспроизводимы без Telegram.
+#
+#   python bench.py --save bench_results/baseline.json
+#   python bench.py --compare bench_results/baseline.json
+#
+# С --compare время каждого замера сравнивается с сохранённым; если какой-то
+# этап стал медленнее больше чем на --threshold, код выхода 1.
+# Этапы, для которых не установлены зависимости, пропускаются.
+
+import os
+import sys
+import json
+import time
+import base64
+import struct
+import argparse
+import platform
+import shutil
+import statistics
+import tempfile
+from datetime import datetime
+
+import gender_index
+from mock_bot import OPUS_PRE_SKIP, OPUS_SAMPLE_RATE, make_silent_ogg
+
+DEFAULT_CORPUS = os.path.join("data", "bench_corpus.txt")
+GENDER_INDEX_SEED = os.path.join("data", "noun_genders.tsv")
+SAMPLE_DURATIONS_MS = (1000, 5000, 20000)
+# Форматы конвертации: по умолчанию сервера и типичные для клиентов
+BENCH_FORMATS = (("wav", 128000, 2), ("wav", 48000, 2), ("wav", 16000, 2), ("pcm", 16000, 2))
+# Допустимое замедление относительно сохранённых результатов (0.2 = 20%)
+REGRESSION_THRESHOLD = 0.2
+
+
+def measure(func, min_time, repeat):
+    """
+    Время одного вызова func в секундах. Число вызовов в раунде подбирается так,
+    чтобы раунд шёл не меньше min_time; из repeat раундов берутся min/median/mean.
+    """
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time or loops >= 1_000_000:
+            break
+        loops = max(loops * 2, int(loops * min_time / max(elapsed, 1e-9)))
+    rounds = [elapsed / loops]
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(loops):
+            func()
+        rounds.append((time.perf_counter() - start) / loops)
+    return {"loops": loops, "min": min(rounds), "median": statistics.median(rounds),
+            "mean": statistics.fmean(rounds)}
+
+
+def load_corpus(path):
+    with open(path, encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def load_samples(paths):
+    """{имя: байты OGG} - из файлов или тишина заданной длительности."""
+    if paths:
+        samples = {}
+        for path in paths:
+            with open(path, "rb") as f:
+                samples[os.path.basename(path)] = f.read()
+        return samples
+    return {f"silence-{ms // 1000}s": make_silent_ogg(ms) for ms in SAMPLE_DURATIONS_MS}
+
+
+def ogg_duration(ogg_bytes):
+    """Длительность OGG/Opus в секундах по позиции (granule) последней страницы."""
+    last_page = ogg_bytes.rfind(b"OggS")
+    if last_page < 0:
+        return 0.0
+    granule = struct.unpack_from("<q", ogg_bytes, last_page + 6)[0]
+    return max(0, granule - OPUS_PRE_SKIP) / OPUS_SAMPLE_RATE
+
+
+def text_benchmarks(corpus, use_mystem, tmp_dir):
+    """Этапы нормализации текста; каждый вызов обрабатывает весь корпус."""
+    from normalizer import expand_numbers
+    import numeral_gender
+
+    benchmarks = [("num2words/corpus", lambda: [expand_numbers(line) for line in corpus])]
+
+    expanded = [expand_numbers(line) for line in corpus]
+    index = gender_index.load_or_build(os.path.join(tmp_dir, "gender_index.bin"), GENDER_INDEX_SEED)
+    if index is not None:
+        benchmarks.append(("numeral_gender/index", lambda: [
+            numeral_gender.correct_numeral_gender_mystem(line, None, index) for line in expanded]))
+
+    if use_mystem:
+        from mystem_pool import MystemPool
+        mystem = MystemPool(1)
+
+        def run_mystem():
+            # Без очистки LRU-кэша Mystem вызывался бы только в первом раунде
+            with numeral_gender._mystem_memo_lock:
+                numeral_gender._mystem_memo.clear()
+            return [numeral_gender.correct_numeral_gender_mystem(line, mystem) for line in expanded]
+
+        benchmarks.append(("numeral_gender/mystem", run_mystem))
+    return benchmarks
+
+
+def audio_benchmarks(samples, skipped):
+    """
+    Конвертация каждого образца в каждый формат: в памяти (PyAV) и через ffmpeg (pydub).
+    Без ffmpeg/ffprobe в PATH второй вариант пропускается (причина - в skipped).
+    """
+    import audio_convert
+    from audio_convert import AudioFormat
+
+    missing_tools = [tool for tool in ("ffmpeg", "ffprobe") if not shutil.which(tool)]
+    if missing_tools:
+        skipped["convert_ffmpeg"] = f"не найдены: {', '.join(missing_tools)}"
+    benchmarks = []
+    for sample_name, ogg_bytes in samples.items():
+        for fmt in BENCH_FORMATS:
+            audio_format = AudioFormat(*fmt)
+            if audio_convert.FAST_DECODE_AVAILABLE:
+                benchmarks.append((f"convert_fast/{sample_name}/{audio_format.key}",
+                                   lambda o=ogg_bytes, f=audio_format: audio_convert.convert_audio_fast(o, f)))
+            if not missing_tools:
+                benchmarks.append((f"convert_ffmpeg/{sample_name}/{audio_format.key}",
+                                   lambda o=ogg_bytes, f=audio_format: audio_convert.convert_audio_ffmpeg(o, f)))
+    return benchmarks
+
+
+def base64_benchmarks(samples):
+    """base64 ответа в формате сервера по умолчанию (WAV 128 кГц, 16 бит) той же длительности."""
+    benchmarks = []
+    for sample_name, ogg_bytes in samples.items():
+        try:
+            import audio_convert
+            wav = audio_convert.convert_audio(ogg_bytes, audio_convert.AudioFormat(*BENCH_FORMATS[0]))
+        except Exception:
+            # Без конвертера - буфер того же размера, скорость base64 от содержимого не зависит
+            _, sample_rate, sample_width = BENCH_FORMATS[0]
+            wav = bytes(44 + int(ogg_duration(ogg_bytes) * sample_rate) * sample_width)
+        benchmarks.append((f"base64/{sample_name}", lambda data=wav: base64.b64encode(data).decode("utf-8")))
+    return benchmarks
+
+
+def collect_benchmarks(args, tmp_dir):
+    corpus = load_corpus(args.corpus)
+    samples = load_samples(args.ogg)
+    benchmarks = []
+    skipped = {}
+    for group, build in (("text", lambda: text_benchmarks(corpus, args.mystem, tmp_dir)),
+                         ("audio", lambda: audio_benchmarks(samples, skipped)),
+                         ("base64", lambda: base64_benchmarks(samples))):
+        try:
+            benchmarks.extend(build())
+        except Exception as e:
+            skipped[group] = f"{type(e).__name__}: {e}"
+    if args.filter:
+        benchmarks = [(name, func) for name, func in benchmarks if args.filter in name]
+    return benchmarks, skipped
+
+
+def compare(results, baseline, threshold):
+    """Список (имя, было, стало, отношение) для замедлившихся этапов."""
+    regressions = []
+    for name, result in results.items():
+        old = baseline.get(name)
+        if not old or not old.get("min"):
+            continue
+        ratio = result["min"] / old["min"]
+        if ratio > 1 + threshold:
+            regressions.append((name, old["min"], result["min"], ratio))
+    return regressions
+
+
+def format_time(seconds):
+    if seconds >= 1:
+        return f"{seconds:.3f} с"
+    if seconds >= 1e-3:
+        return f"{seconds * 1e3:.3f} мс"
+    return f"{seconds * 1e6:.1f} мкс"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Микробенчмарки этапов обработки запроса")
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS, help="файл с текстами, по одному на строку")
+    parser.add_argument("--ogg", action="append", default=[], help="голосовое OGG/Opus (можно несколько)")
+    parser.add_argument("--mystem", action="store_true", help="замерить также разбор Mystem (нужен mystem)")
+    parser.add_argument("--filter", help="только этапы, в имени которых есть эта строка")
+    parser.add_argument("--min-time", type=float, default=0.2, help="минимальная длительность раунда, сек")
+    parser.add_argument("--repeat", type=int, default=5, help="число раундов")
+    parser.add_argument("--save", metavar="PATH", help="сохранить результаты в JSON")
+    parser.add_argument("--compare", metavar="PATH", help="сравнить с сохранёнными результатами")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD,
+                        help="допустимое замедление (0.2 = 20%%)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        benchmarks, skipped = collect_benchmarks(args, tmp_dir)
+        for group, reason in skipped.items():
+            print(f"Пропущено ({group}): {reason}")
+
+        results = {}
+        for name, func in benchmarks:
+            # Упавший этап не должен стоить остальных результатов
+            try:
+                results[name] = measure(func, args.min_time, max(1, args.repeat))
+            except Exception as e:
+                skipped[name] = f"{type(e).__name__}: {e}"
+                print(f"Пропущено ({name}): {skipped[name]}")
+                continue
+            r = results[name]
+            print(f"{name:<50} min {format_time(r['min']):>12}  median {format_time(r['median']):>12}  "
+                  f"({r['loops']} выз.)")
+
+    report = {
+        "meta": {
+            "date": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "corpus": args.corpus,
+            "skipped": skipped,
+        },
+        "results": results,
+    }
+    if args.save:
+        os.makedirs(os.path.dirname(args.save) or ".", exist_ok=True)
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"Результаты сохранены в {args.save}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.threshold)
+        for name, old, new, ratio in regressions:
+            print(f"ЗАМЕДЛЕНИЕ {name}: {format_time(old)} -> {format_time(new)} (x{ratio:.2f})")
+        if regressions:
+            sys.exit(1)
+        print(f"Замедлений больше {args.threshold:.0%} нет.")
+
+
+if __name__ == "__main__":
+    main()
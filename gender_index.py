@@ -0,0 +1,177 @@
+# --- Предрассчитанный индекс "словоформа -> род" ---
+# Для согласования "один"/"два" нужен только род следующего слова, поэтому частые
+# словоформы разбираются Mystem заранее (офлайн) и сохраняются в компактный
+# бинарный файл. Файл открывается через mmap, поиск - бинарный по отсортированным
+# словоформам, без загрузки всего словаря в память.
+#
+# Формат (little-endian):
+#   8 байт   MAGIC
+#   uint32   N - число словоформ
+#   uint32   offsets[N + 1] - смещения словоформ в блоке строк
+#   uint8    codes[N] - (вид << 2) | род
+#   bytes    блок строк (utf-8, отсортирован побайтно)
+#
+# Сборка из частотного списка слов (нужен Mystem):
+#   python gender_index.py wordlist.txt --out gender_index.bin
+# Сборка из готовой таблицы "слово<TAB>вид<TAB>род" (Mystem не нужен):
+#   python gender_index.py --tsv data/noun_genders.tsv --out gender_index.bin
+
+import os
+import sys
+import mmap
+import logging
+import argparse
+from array import array
+
+logger = logging.getLogger("GenderIndex")
+
+MAGIC = b"GIDX1\0\0\0"
+HEADER_SIZE = len(MAGIC) + 4
+
+GENDERS = (None, 'masc', 'femn', 'neut')
+KINDS = {'S': 1, 'A': 2}  # существительное, прилагательное/причастие
+
+
+def encode(kind, gender):
+    return (KINDS[kind] << 2) | GENDERS.index(gender)
+
+
+def decode(code):
+    """Возвращает (род, is_noun) в том же виде, что и numeral_gender.parse_gender."""
+    return GENDERS[code & 3], (code >> 2) == KINDS['S']
+
+
+class GenderIndex:
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mm[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError(f"{path}: неверный формат индекса рода")
+        self.count = int.from_bytes(self._mm[len(MAGIC):HEADER_SIZE], "little")
+        offsets_end = HEADER_SIZE + 4 * (self.count + 1)
+        self._offsets = memoryview(self._mm)[HEADER_SIZE:offsets_end].cast('I')
+        self._codes_start = offsets_end
+        self._blob_start = offsets_end + self.count
+
+    def _word_at(self, i):
+        start = self._blob_start + self._offsets[i]
+        end = self._blob_start + self._offsets[i + 1]
+        return self._mm[start:end]
+
+    def lookup(self, word):
+        """Возвращает (род, is_noun) или None, если словоформы нет в индексе."""
+        key = word.lower().encode("utf-8")
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._word_at(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.count and self._word_at(lo) == key:
+            return decode(self._mm[self._codes_start + lo])
+        return None
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        self._offsets = None
+        self._mm.close()
+        self._file.close()
+
+
+def write_index(entries, path):
+    """Записывает индекс из словаря {словоформа: код}."""
+    if sys.byteorder != "little" or array('I').itemsize != 4:
+        raise RuntimeError("Сборка индекса рода поддерживается только на little-endian платформах")
+    items = sorted((word.lower().encode("utf-8"), code) for word, code in entries.items())
+    offsets = array('I', [0])
+    for word, _ in items:
+        offsets.append(offsets[-1] + len(word))
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(len(items).to_bytes(4, "little"))
+        f.write(offsets.tobytes())
+        f.write(bytes(code for _, code in items))
+        for word, _ in items:
+            f.write(word)
+    os.replace(tmp_path, path)
+
+
+def read_tsv(path):
+    """Читает таблицу "слово<TAB>вид<TAB>род" (строки с # - комментарии)."""
+    entries = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            word, kind, gender = line.split("\t")
+            entries[word.lower()] = encode(kind, gender)
+    return entries
+
+
+def analyze_wordlist(words, mystem, batch_size=5000):
+    """Разбирает список слов Mystem пачками и возвращает {словоформа: код}."""
+    from numeral_gender import parse_gender
+
+    entries = {}
+    for start in range(0, len(words), batch_size):
+        batch = words[start:start + batch_size]
+        for item in mystem.analyze("\n".join(batch)):
+            if not item.get('analysis'):
+                continue
+            gender, is_noun = parse_gender(item['analysis'][0]['gr'])
+            if is_noun is None or not gender:
+                continue
+            entries[item['text'].lower()] = encode('S' if is_noun else 'A', gender)
+        logger.info(f"Разобрано {min(start + batch_size, len(words))}/{len(words)} слов.")
+    return entries
+
+
+def load_or_build(path, seed_tsv=None):
+    """
+    Открывает индекс; если файла нет, собирает его из таблицы seed_tsv.
+    Возвращает None, если индекс недоступен (тогда используется только Mystem).
+    """
+    try:
+        if not os.path.exists(path) and seed_tsv and os.path.exists(seed_tsv):
+            write_index(read_tsv(seed_tsv), path)
+            logger.info(f"Индекс рода собран из {seed_tsv}.")
+        if os.path.exists(path):
+            index = GenderIndex(path)
+            logger.info(f"Индекс рода загружен: {len(index)} словоформ.")
+            return index
+    except Exception as e:
+        logger.error(f"Не удалось загрузить индекс рода {path}: {e}")
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сборка индекса рода словоформ для коррекции числительных")
+    parser.add_argument("wordlist", nargs="?", help="Частотный список слов (первая колонка - слово)")
+    parser.add_argument("--tsv", action="append", default=[], help="Готовая таблица слово/вид/род")
+    parser.add_argument("--out", default="gender_index.bin")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    entries = {}
+    if args.wordlist:
+        from pymystem3 import Mystem
+        with open(args.wordlist, encoding="utf-8") as f:
+            words = [line.split()[0].lower() for line in f if line.strip()]
+        entries.update(analyze_wordlist(words, Mystem(grammar_info=True, entire_input=False)))
+    for tsv in args.tsv:
+        entries.update(read_tsv(tsv))
+    if not entries:
+        parser.error("нужен список слов или --tsv")
+    write_index(entries, args.out)
+    logger.info(f"Индекс записан в {args.out}: {len(entries)} словоформ.")
+
+
+if __name__ == "__main__":
+    main()
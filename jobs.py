@@ -0,0 +1,230 @@
+# --- Асинхронные задания синтеза ---
+# POST /jobs сразу возвращает id задания, а синтез идёт в цикле событий Telegram
+# через тот же кэш и ту же таблицу ожидания, что и /synthesize/. Клиент либо
+# опрашивает GET /jobs/<id>, либо слушает поток событий (SSE) о завершении заданий.
+# Ни поток сервера, ни соединение клиента не заняты на время ожидания бота.
+# Задание хранит не аудио, а ключ кэша: GET /jobs/<id>/audio читает аудио из кэша.
+# Выполняющихся заданий не больше max_jobs, от одного клиента - не больше max_per_client.
+# Поток событий для Flask (iter_events) занимает поток сервера, пока открыт, поэтому
+# он закрывается через max_lifetime секунд; EventSource клиента переподключается сам.
+
+import json
+import time
+import queue
+import asyncio
+import logging
+import itertools
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger("Jobs")
+
+STATE_RUNNING = "running"
+STATE_DONE = "done"
+STATE_ERROR = "error"
+
+
+class TooManyJobs(Exception):
+    """Новые задания не приняты: превышен общий предел выполняющихся или предел клиента."""
+
+
+class Job:
+    def __init__(self, job_id, text, audio_format, client=None):
+        self.id = job_id
+        self.text = text
+        self.audio_format = audio_format
+        self.client = client
+        self.state = STATE_RUNNING
+        self.cache_key = None  # аудио завершённого задания - в кэше под этим ключом
+        self.size = None
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+
+    @property
+    def finished(self):
+        return self.state != STATE_RUNNING
+
+    def to_dict(self):
+        data = {
+            "id": self.id, "state": self.state, "format": self.audio_format.key,
+            "created_at": self.created_at, "finished_at": self.finished_at,
+        }
+        if self.state == STATE_DONE:
+            data["size"] = self.size
+            data["audio_url"] = f"/jobs/{self.id}/audio"
+        elif self.state == STATE_ERROR:
+            data["error"] = self.error
+        return data
+
+
+def format_event(job):
+    """Событие SSE о завершении задания: event - состояние, data - статус в JSON."""
+    return f"id: {job.id}\nevent: {job.state}\ndata: {json.dumps(job.to_dict(), ensure_ascii=False)}\n\n"
+
+
+KEEPALIVE_EVENT = ": keepalive\n\n"
+
+
+class JobStore:
+    """
+    run(text, audio_format) - корутина, которая кладёт аудио в кэш и возвращает (ключ кэша,
+    размер аудио); сами байты задание не держит. Задания выполняются в цикле
+    событий loop; завершённые хранятся ttl секунд (не больше max_jobs), затем удаляются.
+    Выполняющихся заданий не больше max_jobs, от одного клиента - не больше
+    max_per_client (0 - без ограничения). Подписчики (callback(job)) вызываются в цикле
+    событий при завершении каждого задания.
+    """
+
+    def __init__(self, run, ttl, max_jobs, max_per_client=0):
+        self.run = run
+        self.ttl = ttl
+        self.max_jobs = max_jobs
+        self.max_per_client = max_per_client
+        self.jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._subscribers = set()
+        self.completed = 0
+        self.failed = 0
+
+    def submit(self, texts, audio_format, loop, client=None):
+        """Ставит задания на тексты texts (все или ни одного). TooManyJobs - пределы превышены."""
+        with self._lock:
+            self._sweep()
+            running = [job for job in self.jobs.values() if not job.finished]
+            if len(running) + len(texts) > self.max_jobs:
+                raise TooManyJobs(f"Слишком много выполняющихся заданий ({len(running)})")
+            client_running = sum(1 for job in running if job.client == client)
+            if self.max_per_client and client_running + len(texts) > self.max_per_client:
+                raise TooManyJobs(f"Слишком много заданий от клиента ({client_running} выполняется, "
+                                  f"максимум {self.max_per_client})")
+            jobs = []
+            for text in texts:
+                job = Job(f"{int(time.time())}-{next(self._ids)}", text, audio_format, client)
+                self.jobs[job.id] = job
+                jobs.append(job)
+        for job in jobs:
+            asyncio.run_coroutine_threadsafe(self._run(job), loop)
+        return jobs
+
+    def get(self, job_id):
+        with self._lock:
+            return self.jobs.get(job_id)
+
+    @property
+    def running(self):
+        with self._lock:
+            return sum(1 for job in self.jobs.values() if not job.finished)
+
+    def _sweep(self):
+        """Удаляет завершённые задания старше ttl и самые старые сверх max_jobs (под _lock)."""
+        now = time.time()
+        for job_id in [job_id for job_id, job in self.jobs.items()
+                       if job.finished and now - job.finished_at > self.ttl]:
+            del self.jobs[job_id]
+        excess = len(self.jobs) - self.max_jobs
+        if excess > 0:
+            for job_id in [job_id for job_id, job in self.jobs.items() if job.finished][:excess]:
+                del self.jobs[job_id]
+
+    async def _run(self, job):
+        try:
+            job.cache_key, job.size = await self.run(job.text, job.audio_format)
+            job.state = STATE_DONE
+            self.completed += 1
+        except Exception as e:
+            job.error = str(e) or type(e).__name__
+            job.state = STATE_ERROR
+            self.failed += 1
+            logger.warning(f"Задание {job.id} завершилось ошибкой: {job.error}")
+        job.finished_at = time.time()
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for callback in subscribers:
+            try:
+                callback(job)
+            except Exception as e:
+                logger.error(f"Ошибка подписчика заданий: {e}")
+
+    def subscribe(self, callback):
+        with self._lock:
+            self._subscribers.add(callback)
+
+    def unsubscribe(self, callback):
+        with self._lock:
+            self._subscribers.discard(callback)
+
+    def _already_finished(self, ids):
+        with self._lock:
+            return [self.jobs[job_id] for job_id in ids if job_id in self.jobs and self.jobs[job_id].finished]
+
+    def iter_events(self, ids=None, keepalive=15, max_lifetime=0):
+        """
+        Поток SSE для Flask (блокирующий генератор). Без ids - все завершения; с ids -
+        только эти задания, поток закрывается, когда все они завершены (уже завершённые
+        отдаются сразу). Генератор держит поток сервера, пока открыт, поэтому поток
+        закрывается и через max_lifetime секунд (0 - без ограничения). Отключение
+        клиента Werkzeug замечает только при записи - на ближайшем keepalive.
+        """
+        events = queue.Queue()
+        callback = events.put
+        self.subscribe(callback)
+        deadline = time.monotonic() + max_lifetime if max_lifetime else None
+        try:
+            remaining = set(ids or ())
+            for job in self._already_finished(remaining):
+                remaining.discard(job.id)
+                yield format_event(job)
+            while not ids or remaining:
+                timeout = keepalive
+                if deadline is not None:
+                    timeout = min(keepalive, deadline - time.monotonic())
+                    if timeout <= 0:
+                        return
+                try:
+                    job = events.get(timeout=timeout)
+                except queue.Empty:
+                    yield KEEPALIVE_EVENT
+                    continue
+                if ids and job.id not in remaining:
+                    continue
+                remaining.discard(job.id)
+                yield format_event(job)
+        finally:
+            self.unsubscribe(callback)
+
+    async def aiter_events(self, ids=None, keepalive=15, max_lifetime=0):
+        """То же, что iter_events, для асинхронного сервера (в цикле событий заданий)."""
+        events = asyncio.Queue()
+        callback = events.put_nowait
+        self.subscribe(callback)
+        deadline = time.monotonic() + max_lifetime if max_lifetime else None
+        try:
+            remaining = set(ids or ())
+            for job in self._already_finished(remaining):
+                remaining.discard(job.id)
+                yield format_event(job)
+            while not ids or remaining:
+                timeout = keepalive
+                if deadline is not None:
+                    timeout = min(keepalive, deadline - time.monotonic())
+                    if timeout <= 0:
+                        return
+                try:
+                    job = await asyncio.wait_for(events.get(), timeout)
+                except asyncio.TimeoutError:
+                    yield KEEPALIVE_EVENT
+                    continue
+                if ids and job.id not in remaining:
+                    continue
+                remaining.discard(job.id)
+                yield format_event(job)
+        finally:
+            self.unsubscribe(callback)
+
+    def stats(self):
+        with self._lock:
+            jobs = len(self.jobs)
+        return {"jobs": jobs, "running": self.running, "completed": self.completed,
+                "failed": self.failed, "subscribers": len(self._subscribers)}
@@ -0,0 +1,70 @@
+# --- Адаптивные таймауты ожидания бота ---
+# Бот озвучивает длинный текст дольше короткого, а его задержка меняется в течение
+# дня. Фиксированный таймаут либо обрывает длинные тексты, либо заставляет клиента
+# ждать заведомо пропавший ответ. Поэтому задержка запоминается по корзинам длины
+# текста (скользящее среднее и отклонение, как RTO в TCP), а таймаут - это
+# среднее + k отклонений в пределах [minimum, maximum]. Пока замеров мало, таймаут - maximum.
+
+import bisect
+import threading
+
+# Границы корзин длины текста (символы): до 50, до 150, до 300, до 600, длиннее
+DEFAULT_BOUNDS = (50, 150, 300, 600)
+
+
+class _Estimate:
+    def __init__(self):
+        self.mean = None
+        self.deviation = 0.0
+        self.samples = 0
+
+
+class LatencyTracker:
+    """
+    observe(size, seconds) - замер (size - длина текста; без корзин - любое число),
+    deadline(size) - таймаут для нового запроса такой длины.
+    """
+
+    def __init__(self, minimum, maximum, bounds=DEFAULT_BOUNDS, alpha=0.125, k=4, min_samples=5):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.bounds = tuple(bounds)
+        self.alpha = alpha
+        self.k = k
+        self.min_samples = min_samples
+        self._estimates = [_Estimate() for _ in range(len(self.bounds) + 1)]
+        self._lock = threading.Lock()
+
+    def _estimate(self, size):
+        return self._estimates[bisect.bisect_left(self.bounds, size)]
+
+    def observe(self, size, seconds):
+        with self._lock:
+            estimate = self._estimate(size)
+            if estimate.mean is None:
+                estimate.mean = seconds
+                estimate.deviation = seconds / 2
+            else:
+                estimate.deviation += self.alpha * (abs(seconds - estimate.mean) - estimate.deviation)
+                estimate.mean += self.alpha * (seconds - estimate.mean)
+            estimate.samples += 1
+
+    def _deadline(self, estimate):
+        if estimate.samples < self.min_samples:
+            return self.maximum
+        return min(self.maximum, max(self.minimum, estimate.mean + self.k * estimate.deviation))
+
+    def deadline(self, size):
+        with self._lock:
+            return self._deadline(self._estimate(size))
+
+    def stats(self):
+        with self._lock:
+            buckets = [{
+                "max_size": self.bounds[index] if index < len(self.bounds) else None,
+                "samples": estimate.samples,
+                "mean": round(estimate.mean, 3) if estimate.mean is not None else None,
+                "deviation": round(estimate.deviation, 3),
+                "deadline": round(self._deadline(estimate), 3),
+            } for index, estimate in enumerate(self._estimates)]
+        return {"minimum": self.minimum, "maximum": self.maximum, "buckets": buckets}
@@ -0,0 +1,185 @@
+# --- Нагрузочный тест /synthesize/ ---
+# Шлёт запросы на работающий сервер из нескольких потоков и печатает пропускную
+# способность, задержки p50/p95/p99 и долю ошибок по кодам ответа. Вместе с
+# TTS_BACKEND=mock (mock_bot.py) работает полностью без сети:
+#
+#   python loadtest.py --spawn TTS11.py --concurrency 20 --requests 500
+#
+# --spawn запускает сервер с TTS_BACKEND=mock, ждёт порт и останавливает его в конце.
+# Только стандартная библиотека.
+
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import subprocess
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_TEXTS = [
+    "Привет, чат!",
+    "Спасибо за подписку.",
+    "У меня 5 яблок и 21 груша.",
+    "Сегодня мы играем в новую игру.",
+    "Кто-нибудь знает, сколько сейчас времени?",
+    "Это очень длинное сообщение, которое стример прочитает голосом бота, "
+    "чтобы проверить, как сервер справляется с текстами подлиннее.",
+]
+
+
+def load_texts(path):
+    if not path:
+        return DEFAULT_TEXTS
+    with open(path, encoding="utf-8") as f:
+        texts = [line.strip() for line in f if line.strip()]
+    if not texts:
+        raise SystemExit(f"Файл {path} не содержит текстов")
+    return texts
+
+
+def percentile(sorted_values, p):
+    """Перцентиль p (0..100) по отсортированному списку, с интерполяцией."""
+    if not sorted_values:
+        return 0.0
+    k = (len(sorted_values) - 1) * p / 100
+    low = int(k)
+    high = min(low + 1, len(sorted_values) - 1)
+    return sorted_values[low] + (sorted_values[high] - sorted_values[low]) * (k - low)
+
+
+def one_request(url, timeout):
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    except Exception as e:
+        status = type(e).__name__
+    return status, time.perf_counter() - start
+
+
+def build_urls(args, texts):
+    base = args.url.rstrip("/") + "/synthesize/"
+    params = {"format": args.format} if args.format else {}
+    urls = []
+    for i in range(args.requests):
+        text = texts[i % len(texts)]
+        if args.unique:
+            text = f"{text} {i}"  # разные тексты - мимо кэша, каждый запрос доходит до бота
+        query = urllib.parse.urlencode(dict(params, text=text))
+        urls.append(f"{base}?{query}")
+    return urls
+
+
+def run(args):
+    texts = load_texts(args.texts)
+    urls = build_urls(args, texts)
+    results = []
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        for result in executor.map(lambda url: one_request(url, args.timeout), urls):
+            results.append(result)
+    elapsed = time.perf_counter() - start
+
+    statuses = Counter(status for status, _ in results)
+    latencies = sorted(latency for status, latency in results if status == 200)
+    errors = len(results) - statuses.get(200, 0)
+    return {
+        "requests": len(results),
+        "concurrency": args.concurrency,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(results) / elapsed, 2) if elapsed else 0.0,
+        "ok": statuses.get(200, 0),
+        "error_rate": round(errors / len(results), 4) if results else 0.0,
+        "statuses": {str(status): count for status, count in sorted(statuses.items(), key=str)},
+        "latency_s": {
+            "p50": round(percentile(latencies, 50), 4),
+            "p95": round(percentile(latencies, 95), 4),
+            "p99": round(percentile(latencies, 99), 4),
+            "max": round(latencies[-1], 4) if latencies else 0.0,
+        },
+    }
+
+
+def wait_for_port(host, port, timeout, process):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise SystemExit(f"Сервер завершился с кодом {process.returncode}")
+        try:
+            with socket.create_connection((host, port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise SystemExit(f"Сервер не открыл порт {host}:{port} за {timeout} сек")
+
+
+def sessions_ready(url):
+    try:
+        with urllib.request.urlopen(url.rstrip("/") + "/send/stats", timeout=5) as response:
+            sessions = json.load(response)
+    except Exception:
+        return False
+    return any(session.get("ready") for session in sessions.values())
+
+
+def spawn_server(script, url, startup_timeout):
+    env = dict(os.environ, TTS_BACKEND="mock")
+    process = subprocess.Popen([sys.executable, script], env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    parsed = urllib.parse.urlparse(url)
+    try:
+        wait_for_port(parsed.hostname, parsed.port or 80, startup_timeout, process)
+        # Порт Flask открывается раньше, чем стартуют сессии: ждём готовности бота
+        deadline = time.monotonic() + startup_timeout
+        while time.monotonic() < deadline and not sessions_ready(url):
+            time.sleep(0.2)
+    except BaseException:
+        process.terminate()
+        raise
+    return process
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест /synthesize/")
+    parser.add_argument("--url", default="http://127.0.0.1:8124", help="адрес сервера")
+    parser.add_argument("--concurrency", type=int, default=10, help="одновременных запросов")
+    parser.add_argument("--requests", type=int, default=100, help="всего запросов")
+    parser.add_argument("--texts", help="файл с текстами, по одному на строку")
+    parser.add_argument("--unique", action="store_true", help="делать тексты уникальными (без попаданий в кэш)")
+    parser.add_argument("--format", help="параметр format= (например, ogg или wav:16000)")
+    parser.add_argument("--timeout", type=float, default=60, help="таймаут одного запроса, сек")
+    parser.add_argument("--spawn", metavar="SCRIPT", help="запустить сервер (TTS11.py/TITTS.py) с TTS_BACKEND=mock")
+    parser.add_argument("--startup-timeout", type=float, default=60, help="сколько ждать запуска сервера, сек")
+    parser.add_argument("--json", action="store_true", help="вывести результат в JSON")
+    args = parser.parse_args()
+
+    process = spawn_server(args.spawn, args.url, args.startup_timeout) if args.spawn else None
+    try:
+        report = run(args)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=10)
+
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        return
+    latency = report["latency_s"]
+    print(f"Запросов: {report['requests']} (одновременно {report['concurrency']}), "
+          f"за {report['elapsed_s']} сек - {report['throughput_rps']} запр/сек")
+    print(f"Успешных: {report['ok']}, доля ошибок: {report['error_rate']:.2%}")
+    print("Коды ответа: " + ", ".join(f"{status}: {count}" for status, count in report["statuses"].items()))
+    print(f"Задержка успешных, сек: p50 {latency['p50']}, p95 {latency['p95']}, "
+          f"p99 {latency['p99']}, max {latency['max']}")
+
+
+if __name__ == "__main__":
+    main()
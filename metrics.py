@@ -0,0 +1,152 @@
+# --- Метрики в формате Prometheus ---
+# Небольшая реализация текстового формата Prometheus без внешних зависимостей:
+# гистограммы и счётчики с одной меткой, а также метрики, значение которых
+# берётся функцией в момент запроса /metrics (размер таблицы ожидания, кэш и т.п.).
+
+import time
+import threading
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_registry = []
+_registry_lock = threading.Lock()
+
+
+def _register(metric):
+    with _registry_lock:
+        _registry.append(metric)
+    return metric
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Counter:
+    def __init__(self, name, help_text, label=None):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self._values = {}
+        self._lock = threading.Lock()
+        _register(self)
+
+    def inc(self, label_value=None, amount=1):
+        with self._lock:
+            self._values[label_value] = self._values.get(label_value, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = sorted(self._values.items(), key=lambda item: str(item[0]))
+        for label_value, value in values:
+            labels = f'{{{self.label}="{_escape(label_value)}"}}' if self.label else ""
+            lines.append(f"{self.name}{labels} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, label=None, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._series = {}  # метка -> [счётчики корзин, сумма, количество]
+        self._lock = threading.Lock()
+        _register(self)
+
+    def observe(self, label_value, seconds):
+        with self._lock:
+            series = self._series.get(label_value)
+            if series is None:
+                series = self._series[label_value] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += seconds
+            series[2] += 1
+
+    @contextmanager
+    def time(self, label_value=None):
+        """with STAGE_SECONDS.time("download"): ... - замеряет блок, в том числе при исключении."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(label_value, time.perf_counter() - start)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series_list = sorted(((k, [list(v[0]), v[1], v[2]]) for k, v in self._series.items()),
+                                 key=lambda item: str(item[0]))
+        for label_value, (bucket_counts, total, count) in series_list:
+            prefix = f'{self.label}="{_escape(label_value)}",' if self.label else ""
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, bucket_counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{{{prefix}le="{_format_value(bound)}"}} {cumulative}')
+            labels = f"{{{prefix[:-1]}}}" if prefix else ""
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class CallbackMetric:
+    """Значение берётся функцией при каждом запросе /metrics (gauge или counter)."""
+
+    def __init__(self, name, help_text, metric_type, func):
+        self.name = name
+        self.help_text = help_text
+        self.metric_type = metric_type
+        self.func = func
+        _register(self)
+
+    def render(self):
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.metric_type}",
+                f"{self.name} {_format_value(self.func())}"]
+
+
+def gauge_callback(name, help_text, func):
+    return CallbackMetric(name, help_text, "gauge", func)
+
+
+def counter_callback(name, help_text, func):
+    return CallbackMetric(name, help_text, "counter", func)
+
+
+def render():
+    """Все метрики в текстовом формате Prometheus (text/plain; version=0.0.4)."""
+    with _registry_lock:
+        metrics = list(_registry)
+    lines = []
+    for metric in metrics:
+        try:
+            lines.extend(metric.render())
+        except Exception as e:
+            lines.append(f"# ошибка метрики {metric.name}: {e}")
+    return "\n".join(lines) + "\n"
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Общие метрики сервера
+STAGE_SECONDS = Histogram(
+    "tts_stage_seconds",
+    "Длительность этапов обработки запроса: num2words, mystem, telegram_send, bot_wait, download, convert, base64",
+    label="stage")
+REQUEST_SECONDS = Histogram("tts_request_seconds", "Полное время обработки /synthesize/", label="outcome")
+HTTP_RESPONSES = Counter("tts_http_responses_total", "Ответы /synthesize/ по коду статуса", label="status")
+TIMEOUTS = Counter("tts_timeouts_total", "Таймауты по этапам", label="stage")
+TWITCH_SEND_FAILURES = Counter("tts_twitch_send_failures_total", "Неудачные отправки сообщения в чат Twitch")
+REJECTED = Counter("tts_rejected_total", "Запросы, отклонённые из-за перегрузки (503)", label="reason")
+LATE_REPLIES = Counter("tts_late_replies_total", "Ответы бота после таймаута, сохранённые в кэш")
+VOICE_REUSED = Counter("tts_voice_reused_total", "Пропущенные скачивания и конвертации повторных голосовых", label="stage")
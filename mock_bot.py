@@ -0,0 +1,144 @@
+# --- Локальная имитация бота для тестов без Telegram ---
+# MockBotSession подставляется в пул сессий вместо аккаунта Telegram (TTS_BACKEND=mock):
+# "отправка" сообщения возвращает id, а через случайную задержку приходит "голосовое"
+# ответом на него - через тот же обработчик ответов, что и у настоящего бота.
+# Голосовое берётся из файла или, по умолчанию, собирается здесь же: OGG/Opus с
+# тишиной (кадры CELT "тишина"), без ffmpeg и без кодека Opus.
+
+import math
+import random
+import struct
+import hashlib
+import asyncio
+import logging
+import itertools
+
+from session_pool import TelegramSession
+
+logger = logging.getLogger("MockBot")
+
+OPUS_SAMPLE_RATE = 48000
+OPUS_PRE_SKIP = 312
+OPUS_FRAME_MS = 20
+# Кадр Opus (TOC: CELT fullband 20 мс, моно, один кадр), который декодируется в тишину
+OPUS_SILENCE_FRAME = b"\xf8\xff\xfe"
+OGG_PACKETS_PER_PAGE = 50
+
+
+def _ogg_crc_table():
+    table = []
+    for i in range(256):
+        crc = i << 24
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x04C11DB7) if crc & 0x80000000 else (crc << 1)
+        table.append(crc & 0xFFFFFFFF)
+    return table
+
+
+_OGG_CRC_TABLE = _ogg_crc_table()
+
+
+def _ogg_crc(data):
+    crc = 0
+    for byte in data:
+        crc = ((crc << 8) & 0xFFFFFFFF) ^ _OGG_CRC_TABLE[((crc >> 24) & 0xFF) ^ byte]
+    return crc
+
+
+def _ogg_page(packets, granule, serial, sequence, header_type):
+    lacing = []
+    for packet in packets:
+        lacing.extend([255] * (len(packet) // 255))
+        lacing.append(len(packet) % 255)
+    header = struct.pack("<4sBBqIIIB", b"OggS", 0, header_type, granule, serial, sequence, 0, len(lacing))
+    page = bytearray(header + bytes(lacing) + b"".join(packets))
+    struct.pack_into("<I", page, 22, _ogg_crc(page))
+    return bytes(page)
+
+
+def make_silent_ogg(duration_ms=1000, serial=0x5345524F):
+    """OGG/Opus моно 48 кГц заданной длительности - голосовое сообщение с тишиной."""
+    opus_head = struct.pack("<8sBBHIhB", b"OpusHead", 1, 1, OPUS_PRE_SKIP, OPUS_SAMPLE_RATE, 0, 0)
+    vendor = b"mock_bot"
+    opus_tags = struct.pack("<8sI", b"OpusTags", len(vendor)) + vendor + struct.pack("<I", 0)
+    pages = [_ogg_page([opus_head], 0, serial, 0, 0x02), _ogg_page([opus_tags], 0, serial, 1, 0)]
+
+    frame_samples = OPUS_SAMPLE_RATE * OPUS_FRAME_MS // 1000
+    frames = max(1, math.ceil(duration_ms / OPUS_FRAME_MS))
+    written = 0
+    while written < frames:
+        count = min(OGG_PACKETS_PER_PAGE, frames - written)
+        written += count
+        granule = OPUS_PRE_SKIP + written * frame_samples
+        header_type = 0x04 if written == frames else 0
+        pages.append(_ogg_page([OPUS_SILENCE_FRAME] * count, granule, serial, len(pages), header_type))
+    return b"".join(pages)
+
+
+class _MockClient:
+    is_connected = True
+
+    async def stop(self):
+        pass
+
+
+class MockBotSession(TelegramSession):
+    """
+    Сессия-заглушка. reply_handler(session_name, reply_id, download, file_unique_id) - тот
+    же обработчик, что вызывается для голосовых от настоящего бота; download() возвращает
+    байты OGG. file_unique_id зависит от текста и выбранного командами голоса: как
+    настоящий бот, заглушка отвечает на повторный текст тем же файлом.
+    Задержка ответа - логнормальная с медианой latency_ms и разбросом latency_sigma;
+    с вероятностью drop_rate бот не отвечает (проверка таймаутов).
+    """
+
+    def __init__(self, name, reply_handler, ogg_bytes, rate, burst,
+                 latency_ms=1500, latency_sigma=0.3, drop_rate=0.0):
+        super().__init__(name, _MockClient(), rate, burst)
+        self.bot_id = "mock"
+        self.reply_handler = reply_handler
+        self.ogg_bytes = ogg_bytes
+        self.latency_ms = latency_ms
+        self.latency_sigma = latency_sigma
+        self.drop_rate = drop_rate
+        self._message_ids = itertools.count(1)
+        self._tasks = set()
+        self._settings = {}  # команда -> значение (голос, скорость), как их запомнил бы бот
+
+    async def send_message(self, text):
+        message_id = next(self._message_ids)
+        if text.startswith("/"):
+            # Команда переключения голоса: запоминается, голосового в ответ нет
+            command, _, value = text.partition(" ")
+            self._settings[command] = value
+            return message_id
+        if random.random() >= self.drop_rate:
+            task = asyncio.create_task(self._reply(message_id, text, sorted(self._settings.items())))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        return message_id
+
+    def latency(self):
+        if self.latency_sigma <= 0:
+            return self.latency_ms / 1000
+        return random.lognormvariate(math.log(max(self.latency_ms, 1)), self.latency_sigma) / 1000
+
+    async def _reply(self, message_id, text, settings):
+        await asyncio.sleep(self.latency())
+
+        async def download():
+            return self.ogg_bytes
+
+        try:
+            file_unique_id = "mock-" + hashlib.sha1(f"{settings}\n{text}".encode("utf-8")).hexdigest()[:16]
+            await self.reply_handler(self.name, message_id, download, file_unique_id)
+        except Exception as e:
+            logger.error(f"Ошибка обработки ответа заглушки на сообщение {message_id}: {e}")
+
+
+def load_voice(path, duration_ms=1000):
+    """Голосовое для ответов: из файла path, если задан, иначе тишина duration_ms."""
+    if path:
+        with open(path, "rb") as f:
+            return f.read()
+    return make_silent_ogg(duration_ms)
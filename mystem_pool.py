@@ -0,0 +1,109 @@
+# --- Пул процессов Mystem ---
+# Один экземпляр Mystem - это один процесс mystem с одним каналом, поэтому
+# параллельные запросы Flask выстраиваются в очередь за ним. Пул держит несколько
+# экземпляров, выдаёт их по одному на вызов и перезапускает упавшие.
+
+import queue
+import logging
+import threading
+from contextlib import contextmanager
+
+from pymystem3 import Mystem
+
+logger = logging.getLogger("MystemPool")
+
+
+def create_mystem():
+    return Mystem(grammar_info=True, entire_input=False)
+
+
+class MystemPool:
+    def __init__(self, size, factory=create_mystem, checkout_timeout=10):
+        self.size = max(1, size)
+        self.factory = factory
+        self.checkout_timeout = checkout_timeout
+        self._idle = queue.Queue()
+        self._lock = threading.Lock()
+        self.restarts = 0
+
+        # Первый экземпляр создаётся и проверяется сразу: если Mystem не работает,
+        # исключение уходит вызывающему, как и при обычной инициализации
+        first = self.factory()
+        first.analyze("тест")
+        self._idle.put(first)
+        for _ in range(self.size - 1):
+            try:
+                self._idle.put(self._start_instance())
+            except Exception as e:
+                logger.error(f"Не удалось запустить дополнительный экземпляр Mystem: {e}")
+                self.size -= 1
+        logger.info(f"Пул Mystem запущен: {self.size} экземпляров.")
+
+    def _start_instance(self):
+        instance = self.factory()
+        instance.analyze("тест")
+        return instance
+
+    @staticmethod
+    def _is_alive(instance):
+        # pymystem3 держит процесс в _proc (при работе через канал); без него проверять нечего
+        proc = getattr(instance, "_proc", None)
+        return proc is None or proc.poll() is None
+
+    @staticmethod
+    def _close(instance):
+        try:
+            instance.close()
+        except Exception:
+            pass
+
+    def _restart(self, instance):
+        self._close(instance)
+        with self._lock:
+            self.restarts += 1
+        logger.warning("Перезапуск экземпляра Mystem.")
+        return self._start_instance()
+
+    @contextmanager
+    def checkout(self):
+        """Выдаёт свободный экземпляр Mystem; упавший экземпляр перезапускается."""
+        try:
+            instance = self._idle.get(timeout=self.checkout_timeout)
+        except queue.Empty:
+            raise TimeoutError("Нет свободного экземпляра Mystem")
+
+        healthy = True
+        try:
+            if not self._is_alive(instance):
+                instance = self._restart(instance)
+            yield instance
+        except Exception:
+            healthy = False
+            raise
+        finally:
+            if not healthy:
+                try:
+                    instance = self._restart(instance)
+                except Exception as e:
+                    logger.error(f"Не удалось перезапустить Mystem: {e}")
+                    instance = None
+            if instance is not None:
+                self._idle.put(instance)
+            else:
+                with self._lock:
+                    self.size -= 1
+
+    def analyze(self, text):
+        """Совместим с Mystem.analyze, поэтому пул можно передавать вместо экземпляра."""
+        with self.checkout() as instance:
+            return instance.analyze(text)
+
+    def stats(self):
+        return {"size": self.size, "idle": self._idle.qsize(), "restarts": self.restarts}
+
+    def close(self):
+        while True:
+            try:
+                self._close(self._idle.get_nowait())
+            except queue.Empty:
+                break
@@ -0,0 +1,87 @@
+# --- Нормализация чисел перед отправкой боту ---
+# Все числовые конструкции (время, проценты, диапазоны, дроби, целые) находятся одним
+# заранее скомпилированным выражением за один проход по тексту. Частые значения
+# берутся из предрассчитанной таблицы, остальные - из LRU-кэша поверх num2words.
+
+import re
+import logging
+from functools import lru_cache
+
+from num2words import num2words
+
+logger = logging.getLogger("Normalizer")
+
+# Числа 0..999 встречаются чаще всего - считаем их один раз при импорте
+SMALL_NUMBERS = [num2words(i, lang='ru') for i in range(1000)]
+MINUS_WORD = "минус"
+
+# Минус считается знаком числа, только если перед ним нет буквы/цифры ("5-6" - диапазон)
+_MINUS = r"(?:(?<![\w-])-)?"
+
+NUMBER_RE = re.compile(rf"""
+    (?P<time>(?<![\d:])(?P<hours>[01]?\d|2[0-3]):(?P<minutes>[0-5]\d)(?![\d:]))
+  | (?P<percent>(?P<percent_value>{_MINUS}\d+(?:[.,]\d+)?)\s?%)
+  | (?P<range>(?<![\d.,])(?P<range_from>\d+)\s?[-–—]\s?(?P<range_to>\d+)(?![.,]?\d)(?P<range_percent>\s?%)?)
+  | (?P<decimal>{_MINUS}(?<![\d.,])\d+[.,]\d+(?![.,]?\d))
+  | (?P<integer>{_MINUS}\d+)
+""", re.VERBOSE)
+
+
+@lru_cache(maxsize=4096)
+def number_to_words(number_str):
+    """Число в виде строки ("42", "-7", "3,5") -> слова."""
+    number_str = number_str.replace(',', '.')
+    if '.' in number_str:
+        # num2words сам приводит строку к Decimal, без потерь точности float
+        return num2words(number_str, lang='ru')
+    value = int(number_str)
+    if 0 <= value < len(SMALL_NUMBERS):
+        return SMALL_NUMBERS[value]
+    if -len(SMALL_NUMBERS) < value < 0:
+        return f"{MINUS_WORD} {SMALL_NUMBERS[-value]}"
+    return num2words(value, lang='ru')
+
+
+def percent_word(number_str):
+    """Форма слова "процент" после числа."""
+    if '.' in number_str or ',' in number_str:
+        return "процента"
+    value = abs(int(number_str))
+    if 11 <= value % 100 <= 14:
+        return "процентов"
+    if value % 10 == 1:
+        return "процент"
+    if 2 <= value % 10 <= 4:
+        return "процента"
+    return "процентов"
+
+
+def _minutes_to_words(minutes):
+    # "12:05" читается как "двенадцать ноль пять"
+    if minutes.startswith('0'):
+        return f"{SMALL_NUMBERS[0]} {SMALL_NUMBERS[int(minutes)]}"
+    return number_to_words(minutes)
+
+
+def _replace(match):
+    try:
+        if match.group('time'):
+            return f"{number_to_words(match.group('hours'))} {_minutes_to_words(match.group('minutes'))}"
+        if match.group('percent'):
+            value = match.group('percent_value')
+            return f"{number_to_words(value)} {percent_word(value)}"
+        if match.group('range'):
+            range_to = match.group('range_to')
+            words = f"{number_to_words(match.group('range_from'))}-{number_to_words(range_to)}"
+            if match.group('range_percent'):
+                words = f"{words} {percent_word(range_to)}"
+            return words
+        return number_to_words(match.group(0))
+    except Exception as e:
+        logger.warning(f"Ошибка num2words для '{match.group(0)}': {e}. Используется оригинал.")
+        return match.group(0)
+
+
+def expand_numbers(text):
+    """Заменяет числа, время, проценты, диапазоны и дроби словами за один проход."""
+    return NUMBER_RE.sub(_replace, text)
@@ -0,0 +1,157 @@
+# --- Коррекция рода числительных "один"/"два" ---
+# num2words выдаёт числительные в мужском роде ("двадцать один минута"), поэтому
+# род согласуется со следующим существительным. Род сначала ищется в предрассчитанном
+# индексе (gender_index.py) и в LRU-кэше прошлых разборов; оставшиеся слова
+# разбираются Mystem за один вызов (один обмен с процессом mystem на запрос).
+
+import re
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger("NumeralGender")
+
+# Формы, которые подставляются вместо мужского рода
+NUMERAL_FORMS = {
+    "один": {"femn": "одна", "neut": "одно"},
+    "два": {"femn": "две"},
+}
+# Сколько слов после числительного просматривать в поисках существительного
+# ("одна новая красная машина")
+LOOKAHEAD_WORDS = 3
+
+# Размер LRU-кэша результатов Mystem для слов, которых нет в индексе
+MYSTEM_MEMO_SIZE = 20000
+
+WORD_RE = re.compile(r"^(\W*)([а-яё]+)(\W*)$", re.IGNORECASE)
+
+_mystem_memo = OrderedDict()
+_mystem_memo_lock = threading.Lock()
+
+
+def parse_gender(gr):
+    """
+    По строке граммем Mystem возвращает (род, is_noun).
+    Род - 'masc'/'femn'/'neut' или None; is_noun - True для существительного.
+    Для прилагательных и причастий род берётся только в единственном числе.
+    """
+    gender = None
+    if 'жен' in gr:
+        gender = 'femn'
+    elif 'сред' in gr:
+        gender = 'neut'
+    elif 'муж' in gr:
+        gender = 'masc'
+
+    if gr.startswith('S,'):
+        return gender, True
+    if gr.startswith(('A=', 'A,', 'APRO')) or (gr.startswith('V,') and 'прич' in gr):
+        return gender, False
+    return None, None
+
+
+def analyze_words(words, mystem):
+    """Разбирает набор слов одним вызовом Mystem. Возвращает {слово: строка граммем}."""
+    if not words:
+        return {}
+    analysis = mystem.analyze("\n".join(words))
+    grammar = {}
+    for item in analysis:
+        if item.get('analysis'):
+            grammar[item['text'].lower()] = item['analysis'][0]['gr']
+    return grammar
+
+
+def resolve_genders(words, mystem=None, gender_index=None):
+    """
+    Возвращает {слово: (род, is_noun)} для набора слов в нижнем регистре.
+    Порядок: индекс -> LRU-кэш -> один вызов Mystem для оставшихся.
+    Слова, которые не удалось разобрать, получают (None, None).
+    """
+    resolved = {}
+    missing = []
+    with _mystem_memo_lock:
+        for word in words:
+            found = gender_index.lookup(word) if gender_index is not None else None
+            if found is None and word in _mystem_memo:
+                _mystem_memo.move_to_end(word)
+                found = _mystem_memo[word]
+            if found is None:
+                missing.append(word)
+            else:
+                resolved[word] = found
+
+    if missing and mystem is not None:
+        try:
+            grammar = analyze_words(missing, mystem)
+        except Exception as e:
+            logger.warning(f"Ошибка анализа Mystem для {missing}: {e}")
+        else:
+            with _mystem_memo_lock:
+                for word in missing:
+                    found = parse_gender(grammar.get(word, ''))
+                    resolved[word] = found
+                    _mystem_memo[word] = found
+                while len(_mystem_memo) > MYSTEM_MEMO_SIZE:
+                    _mystem_memo.popitem(last=False)
+
+    for word in missing:
+        resolved.setdefault(word, (None, None))
+    return resolved
+
+
+def _match_case(template, word):
+    return word.capitalize() if template[:1].isupper() else word
+
+
+def correct_numeral_gender_mystem(text, mystem=None, gender_index=None):
+    """
+    Корректирует род числительных "один" и "два" (в том числе в составе
+    "двадцать один", "тысяча два") на основе следующего существительного.
+    Mystem используется только для слов, которых нет в gender_index.
+    """
+    tokens = text.split(' ')
+    parsed = [WORD_RE.match(token) for token in tokens]
+
+    # Собираем числительные и слова, которые нужно разобрать
+    targets = []
+    words_to_analyze = []
+    for i, match in enumerate(parsed):
+        if not match or match.group(3) or match.group(2).lower() not in NUMERAL_FORMS:
+            continue
+        following = []
+        for j in range(i + 1, min(i + 1 + LOOKAHEAD_WORDS, len(tokens))):
+            next_match = parsed[j]
+            if not next_match or next_match.group(1):
+                break
+            following.append(next_match.group(2).lower())
+            # Знак препинания после слова - граница, дальше не смотрим
+            if next_match.group(3):
+                break
+        if following:
+            targets.append((i, following))
+            words_to_analyze.extend(w for w in following if w not in words_to_analyze)
+
+    if not targets:
+        return text
+
+    genders = resolve_genders(words_to_analyze, mystem, gender_index)
+
+    corrected = list(tokens)
+    for i, following in targets:
+        gender = None
+        for word in following:
+            word_gender, is_noun = genders[word]
+            if is_noun is None:
+                break
+            if word_gender or is_noun:
+                gender = word_gender
+                break
+
+        match = parsed[i]
+        numeral = match.group(2)
+        replacement = NUMERAL_FORMS[numeral.lower()].get(gender)
+        if replacement:
+            corrected[i] = match.group(1) + _match_case(numeral, replacement)
+
+    return ' '.join(corrected)
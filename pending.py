@@ -0,0 +1,228 @@
+# --- Таблица запросов, ожидающих ответа бота ---
+# Запись создаётся на нормализованный текст и после отправки привязывается к id
+# сообщения в Telegram. Ответ бота находится по reply_to_message.id - точно и за O(1),
+# независимо от длины текста и от того, как бот его нормализовал. При нескольких
+# аккаунтах (session_pool.py) id уникальны только внутри аккаунта, поэтому ключ -
+# пара (имя сессии, id сообщения).
+# Размер таблицы ограничен (max_entries): новый текст сверх лимита не принимается,
+# а записи, которые никто не снял (ожидающий пропал), удаляет sweep() по возрасту.
+# Запросы, снятые до ответа бота (таймаут), ещё late_ttl секунд находятся по id
+# сообщения через pop_late(): опоздавшее голосовое можно сохранить в кэш.
+
+import time
+import asyncio
+import threading
+from collections import OrderedDict
+
+# Сколько снятых без ответа запросов помнить для pop_late()
+LATE_MAX = 1000
+
+
+class PendingRequest:
+    def __init__(self, text, voice=None):
+        self.text = text
+        self.voice = voice  # Требуемый голос бота (voice.VoiceSetting) или None
+        self.sent_voice = voice  # Голос, с которым ушло сообщение (voice + состояние чата); по нему ключ кэша
+        self.formats = set()  # Форматы аудио, которые ждут ожидающие (AudioFormat)
+        self.message_id = None
+        self.session = None  # Имя сессии Telegram, через которую ушло сообщение
+        self.sent_at = None  # Время отправки боту (для замера ожидания ответа)
+        self.event = threading.Event()
+        self.futures = []  # asyncio.Future ожидающих из асинхронного HTTP-сервера
+        self.result = None  # {ключ формата: байты аудио}
+        self.error = None
+        self.waiters = 1
+        self.created_at = time.time()
+        self.removed = False  # удалена из таблицы (последним ожидающим или sweep)
+
+    @property
+    def done(self):
+        return self.result is not None or self.error is not None
+
+
+def _resolve_future(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class PendingTableFull(Exception):
+    """В таблице max_entries запросов - новый текст отправить боту нельзя."""
+
+
+class PendingTable:
+    def __init__(self, max_entries=0, late_ttl=0):
+        self.max_entries = max_entries  # 0 - без ограничения
+        self.late_ttl = late_ttl  # 0 - опоздавшие ответы не сопоставляются
+        self._late = OrderedDict()
+        self._lock = threading.Lock()
+        self._by_message_id = {}
+        self._by_text = {}
+        self._count = 0
+        self.rejected = 0
+        self.swept = 0
+
+    def acquire(self, text, audio_format, voice=None):
+        """
+        Возвращает (запрос, is_owner). Если такой текст с тем же голосом уже в полёте,
+        вызывающий присоединяется к нему как ещё один ожидающий и не должен отправлять
+        текст боту. audio_format добавляется к форматам, в которые нужно сконвертировать ответ.
+        """
+        with self._lock:
+            request_data = self._by_text.get((text, voice))
+            if request_data and request_data.error is None:
+                request_data.waiters += 1
+                request_data.formats.add(audio_format)
+                return request_data, False
+            if self.max_entries and self._count >= self.max_entries:
+                self.rejected += 1
+                raise PendingTableFull(f"Слишком много запросов в ожидании ответа бота ({self._count})")
+            request_data = PendingRequest(text, voice)
+            request_data.formats.add(audio_format)
+            self._by_text[(text, voice)] = request_data
+            self._count += 1
+            return request_data, True
+
+    def requested_formats(self, request_data):
+        with self._lock:
+            return list(request_data.formats)
+
+    def bind_message_id(self, request_data, message_id, session=None, sent_voice=None):
+        """
+        Привязывает запрос к id отправленного сообщения, чтобы сопоставить ответ бота.
+        sent_voice - настройка голоса, с которой сообщение ушло (см. SendScheduler).
+        Запрос, который уже снят (sweep, пока сообщение ждало в очереди отправки) или
+        завершён, не привязывается: иначе он остался бы в индексе навсегда.
+        """
+        with self._lock:
+            if request_data.removed or request_data.done:
+                return
+            request_data.message_id = message_id
+            request_data.session = session
+            if sent_voice is not None:
+                request_data.sent_voice = sent_voice
+            request_data.sent_at = time.time()
+            self._by_message_id[(session, message_id)] = request_data
+
+    def get_by_message_id(self, message_id, session=None):
+        with self._lock:
+            return self._by_message_id.get((session, message_id))
+
+    def count_by_session(self):
+        """{имя сессии: число отправленных запросов, ещё не получивших ответ}."""
+        counts = {}
+        with self._lock:
+            for (session, _), request_data in self._by_message_id.items():
+                if not request_data.done:
+                    counts[session] = counts.get(session, 0) + 1
+        return counts
+
+    def expire_session(self, session):
+        """
+        Снимает запросы, отправленные через session и ещё ждущие ответа, и забывает её
+        опоздавшие запросы: после переключения голоса их ответы озвучены другим голосом.
+        Ожидающие получают ошибку. Возвращает число снятых.
+        """
+        with self._lock:
+            expired = [request_data for (name, _), request_data in self._by_message_id.items()
+                       if name == session and not request_data.done]
+            for request_data in expired:
+                self._remove(request_data)
+            for message_key in [message_key for message_key in self._late if message_key[0] == session]:
+                del self._late[message_key]
+        for request_data in expired:
+            self.complete(request_data, error=TimeoutError("Бот не ответил до переключения голоса"))
+        return len(expired)
+
+    def complete(self, request_data, result=None, error=None):
+        """Записывает результат или ошибку и будит всех ожидающих. False, если уже записано."""
+        with self._lock:
+            if request_data.done:
+                return False
+            if error is not None:
+                request_data.error = error
+            elif result:
+                request_data.result = result
+            else:
+                request_data.error = Exception("Неизвестная ошибка обработки аудио (нет результата)")
+            futures, request_data.futures = request_data.futures, []
+        request_data.event.set()
+        for future in futures:
+            future.get_loop().call_soon_threadsafe(_resolve_future, future)
+        return True
+
+    def wait_async(self, request_data):
+        """
+        Возвращает asyncio.Future, которое завершится вместе с запросом.
+        Вызывается из корутины; поток при ожидании не занимается.
+        """
+        future = asyncio.get_running_loop().create_future()
+        with self._lock:
+            if request_data.done:
+                future.set_result(None)
+            else:
+                request_data.futures.append(future)
+        return future
+
+    def _remove(self, request_data):
+        """Удаляет запись из индексов (под _lock). False, если она уже удалена."""
+        if request_data.removed:
+            return False
+        request_data.removed = True
+        text_key = (request_data.text, request_data.voice)
+        if self._by_text.get(text_key) is request_data:
+            del self._by_text[text_key]
+        message_key = (request_data.session, request_data.message_id)
+        if request_data.message_id is not None and self._by_message_id.get(message_key) is request_data:
+            del self._by_message_id[message_key]
+            if self.late_ttl and not request_data.done:
+                self._late[message_key] = request_data
+                self._prune_late()
+        self._count -= 1
+        return True
+
+    def _prune_late(self):
+        """Забывает снятые запросы старше late_ttl и сверх LATE_MAX (под _lock)."""
+        now = time.time()
+        while self._late:
+            request_data = next(iter(self._late.values()))
+            if len(self._late) <= LATE_MAX and now - request_data.sent_at <= self.late_ttl:
+                break
+            self._late.popitem(last=False)
+
+    def pop_late(self, message_id, session=None):
+        """Запрос, снятый до ответа бота на сообщение message_id (или None)."""
+        with self._lock:
+            self._prune_late()
+            return self._late.pop((session, message_id), None)
+
+    def release(self, request_data):
+        """Снимает одного ожидающего. True, если это был последний и запись удалена."""
+        with self._lock:
+            request_data.waiters -= 1
+            if request_data.waiters > 0 or request_data.removed:
+                return False
+            self._remove(request_data)
+            return True
+
+    def sweep(self, max_age):
+        """
+        Удаляет записи старше max_age секунд - их ожидающие пропали, не сняв запись
+        (или бот так и не ответил). Оставшиеся ожидающие получают ошибку. Возвращает число удалённых.
+        """
+        now = time.time()
+        with self._lock:
+            stale = [request_data for request_data in set(self._by_text.values()) | set(self._by_message_id.values())
+                     if now - request_data.created_at > max_age and self._remove(request_data)]
+            self.swept += len(stale)
+        for request_data in stale:
+            self.complete(request_data, error=TimeoutError("Запрос удалён из ожидания по истечении времени"))
+        return len(stale)
+
+    @property
+    def full(self):
+        with self._lock:
+            return bool(self.max_entries) and self._count >= self.max_entries
+
+    def __len__(self):
+        with self._lock:
+            return self._count
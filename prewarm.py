@@ -0,0 +1,135 @@
+# --- Фоновый синтез пачек фраз (прогрев кэша) ---
+# Известные заранее фразы (алерты, оверлеи) синтезируются в фоне и попадают в кэш
+# аудио, чтобы потом отдаваться мгновенно. Пачки приходят из POST /synthesize/batch
+# или из файла фраз при запуске. Обрабатывает их небольшое число рабочих корутин в
+# цикле событий Telegram; сообщения боту уходят в фоновой полосе очереди отправки
+# (send_scheduler.PRIORITY_BACKGROUND), поэтому интерактивные запросы идут первыми.
+
+import time
+import asyncio
+import logging
+import itertools
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger("Prewarm")
+
+# Сколько последних ошибок хранить в статусе пачки
+MAX_BATCH_ERRORS = 20
+
+
+class Batch:
+    def __init__(self, batch_id, texts, audio_format, source):
+        self.id = batch_id
+        self.texts = texts
+        self.audio_format = audio_format
+        self.source = source  # "api" или "file"
+        self.total = len(texts)
+        self.synthesized = 0
+        self.cached = 0  # уже были в кэше
+        self.failed = 0
+        self.errors = []
+        self.created_at = time.time()
+        self.finished_at = None
+
+    @property
+    def processed(self):
+        return self.synthesized + self.cached + self.failed
+
+    @property
+    def finished(self):
+        return self.processed >= self.total
+
+    def to_dict(self):
+        return {
+            "id": self.id, "source": self.source, "format": self.audio_format.key,
+            "state": "done" if self.finished else "running",
+            "total": self.total, "processed": self.processed,
+            "synthesized": self.synthesized, "cached": self.cached, "failed": self.failed,
+            "progress": round(self.processed / self.total, 3) if self.total else 1.0,
+            "errors": list(self.errors),
+            "created_at": self.created_at, "finished_at": self.finished_at,
+        }
+
+
+class PrewarmQueue:
+    """
+    synthesize(text, audio_format) - корутина, которая кладёт аудио текста в кэш и
+    возвращает True, если оно уже там было. submit() можно вызывать из любого потока;
+    пачки встают в очередь до start(loop). Хранятся последние max_batches пачек.
+    """
+
+    def __init__(self, synthesize, workers, max_batches=100):
+        self.synthesize = synthesize
+        self.workers = max(1, workers)
+        self.max_batches = max_batches
+        self.batches = OrderedDict()
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._loop = None
+        self._queue = None
+        self._backlog = []  # пачки, пришедшие до start()
+        self.queued = 0
+
+    def start(self, loop):
+        """Запускает рабочие корутины; вызывается из цикла событий loop."""
+        self._loop = loop
+        self._queue = asyncio.Queue()
+        for _ in range(self.workers):
+            loop.create_task(self._worker())
+        with self._lock:
+            backlog, self._backlog = self._backlog, []
+        for batch in backlog:
+            self._enqueue(batch)
+
+    def submit(self, texts, audio_format, source="api"):
+        with self._lock:
+            batch = Batch(str(next(self._ids)), list(texts), audio_format, source)
+            self.batches[batch.id] = batch
+            while len(self.batches) > self.max_batches:
+                self.batches.popitem(last=False)
+            if self._loop is None:
+                self._backlog.append(batch)
+                return batch
+        self._loop.call_soon_threadsafe(self._enqueue, batch)
+        return batch
+
+    def get(self, batch_id):
+        with self._lock:
+            return self.batches.get(batch_id)
+
+    def _enqueue(self, batch):
+        if not batch.total:
+            batch.finished_at = time.time()
+        for text in batch.texts:
+            self.queued += 1
+            self._queue.put_nowait((batch, text))
+
+    async def _worker(self):
+        while True:
+            batch, text = await self._queue.get()
+            self.queued -= 1
+            try:
+                if await self.synthesize(text, batch.audio_format):
+                    batch.cached += 1
+                else:
+                    batch.synthesized += 1
+            except Exception as e:
+                batch.failed += 1
+                batch.errors = (batch.errors + [f"{text[:50]}: {e or type(e).__name__}"])[-MAX_BATCH_ERRORS:]
+                logger.warning(f"Пачка {batch.id}: не удалось синтезировать '{text[:50]}': {e}")
+            if batch.finished:
+                batch.finished_at = time.time()
+                logger.info(f"Пачка {batch.id} ({batch.source}) обработана: синтезировано {batch.synthesized}, "
+                            f"из кэша {batch.cached}, ошибок {batch.failed}.")
+
+    def stats(self):
+        with self._lock:
+            batches = [batch.to_dict() for batch in self.batches.values()]
+        return {"workers": self.workers, "queued": self.queued, "batches": batches}
+
+
+def read_phrases(path):
+    """Фразы из файла: по одной на строку, пустые строки и строки с # пропускаются."""
+    with open(path, encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip() and not line.lstrip().startswith("#")]
@@ -0,0 +1,272 @@
+# --- Очередь отправки сообщений боту ---
+# Все сообщения боту проходят через одну очередь с приоритетами: интерактивные
+# запросы (TTS в реальном времени) всегда раньше фоновых (прогрев кэша и т.п.).
+# Темп ограничен "ведром токенов" (rate сообщений в секунду, пачка до burst), а
+# FloodWait от Telegram ставит на паузу всю очередь, а не одну корутину: пока
+# пауза не истекла, не уходит ни одно сообщение, и повтор встаёт в начало очереди.
+# Сообщение может требовать голос бота (voice.VoiceSetting): если чат настроен иначе,
+# перед ним уходят команды переключения, а внутри полосы сначала идут сообщения с
+# текущим голосом (но не дольше max_defer секунд ожидания первого в полосе).
+
+import time
+import bisect
+import asyncio
+import logging
+import itertools
+
+from pyrogram.errors import FloodWait
+
+from voice import resolve_voice
+
+logger = logging.getLogger("SendScheduler")
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 1
+LANES = {PRIORITY_INTERACTIVE: "interactive", PRIORITY_BACKGROUND: "background"}
+
+# Сколько раз повторять сообщение, получившее FloodWait
+MAX_ATTEMPTS = 3
+# Сколько секунд сообщение с другим голосом может ждать, пропуская вперёд сообщения с текущим
+MAX_VOICE_DEFER = 2.0
+
+
+class _QueuedMessage:
+    __slots__ = ("text", "future", "on_sent", "voice", "queued_at", "attempts")
+
+    def __init__(self, text, future, on_sent, voice):
+        self.text = text
+        self.future = future
+        self.on_sent = on_sent
+        self.voice = voice
+        self.queued_at = time.monotonic()
+        self.attempts = 0
+
+
+class SendScheduler:
+    """
+    send_func(text) - корутина, которая отправляет сообщение и возвращает его id.
+    send() ставит сообщение в очередь и ждёт, пока оно уйдёт. on_sent(message_id, voice)
+    вызывается в цикле событий сразу после отправки, до пробуждения вызывающего; voice -
+    настройка, с которой ушло сообщение (требование, дополненное состоянием чата).
+    switch_commands(target, current) - команды, переводящие чат бота в нужный голос
+    (без неё требование голоса у сообщений не учитывается). before_switch() - корутина,
+    которая перед переключением ждёт ответов бота на уже отправленные сообщения.
+    send(timeout=...) ограничивает ожидание отправки, не считая времени переключений голоса.
+    """
+
+    def __init__(self, send_func, rate, burst, switch_commands=None, max_defer=MAX_VOICE_DEFER, before_switch=None):
+        self.send_func = send_func
+        self.switch_commands = switch_commands
+        self.before_switch = before_switch
+        self.max_defer = max_defer
+        self.voice = None  # текущий голос чата (None - неизвестен)
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lanes = {priority: [] for priority in LANES}  # (priority, seq, сообщение) по порядку seq
+        self._has_messages = None
+        self._worker = None
+        self._tasks = set()  # отправки в работе
+        self._seq = itertools.count()
+        self.queued = dict.fromkeys(LANES, 0)
+        self.in_flight = 0
+        self.sent = 0
+        self.failed = 0
+        self.flood_waits = 0
+        self.voice_switches = 0
+        self._switch_seconds = 0.0  # сколько очередь простояла в переключениях голоса
+        self._switch_started = None
+
+    async def send(self, text, priority=PRIORITY_INTERACTIVE, on_sent=None, voice=None, timeout=None):
+        if self._worker is None:
+            # Событие и рабочая задача создаются внутри работающего цикла событий
+            self._has_messages = asyncio.Event()
+            self._worker = asyncio.create_task(self._run())
+        future = asyncio.get_running_loop().create_future()
+        self._put((priority, next(self._seq), _QueuedMessage(text, future, on_sent, voice)))
+        if timeout is None:
+            return await future
+        return await self._wait_sent(future, timeout)
+
+    async def _wait_sent(self, future, timeout):
+        """
+        Ждёт отправки timeout секунд плюс время переключений голоса за это ожидание: пока
+        очередь ждёт ответов бота перед сменой голоса (до switch_wait), не уходит ни одно
+        сообщение, и таймаут отправки сработал бы по причине, не связанной с перегрузкой.
+        """
+        try:
+            while True:
+                switched = self.switch_seconds()
+                done, _ = await asyncio.wait((future,), timeout=timeout)
+                if done:
+                    return future.result()
+                timeout = self.switch_seconds() - switched
+                if timeout <= 0:
+                    raise asyncio.TimeoutError("сообщение не ушло боту за отведённое время (очередь отправки занята)")
+        finally:
+            # Вызывающий перестал ждать - очередь пропустит сообщение
+            future.cancel()
+
+    def switch_seconds(self):
+        """Сколько секунд очередь провела в переключениях голоса, включая текущее."""
+        if self._switch_started is None:
+            return self._switch_seconds
+        return self._switch_seconds + time.monotonic() - self._switch_started
+
+    def _put(self, entry):
+        # Повтор сохраняет свой seq и поэтому встаёт перед более поздними сообщениями
+        self.queued[entry[0]] += 1
+        bisect.insort(self._lanes[entry[0]], entry)
+        self._has_messages.set()
+
+    async def _get(self):
+        while not any(self._lanes.values()):
+            self._has_messages.clear()
+            await self._has_messages.wait()
+        entry = self._select()
+        self.queued[entry[0]] -= 1
+        return entry
+
+    def _voice_ready(self, message):
+        return message.voice is None or self.switch_commands is None or message.voice.satisfied_by(self.voice)
+
+    def _select(self):
+        """Первое сообщение самой приоритетной полосы; если ему нужен другой голос - сначала сообщения с текущим."""
+        for priority in sorted(self._lanes):
+            lane = self._lanes[priority]
+            if not lane:
+                continue
+            head = lane[0][2]
+            if not self._voice_ready(head) and time.monotonic() - head.queued_at < self.max_defer:
+                for index, entry in enumerate(lane):
+                    if self._voice_ready(entry[2]):
+                        return lane.pop(index)
+            return lane.pop(0)
+
+    def _take_token(self, now):
+        """Забирает токен; если токенов нет, возвращает, сколько секунд ждать."""
+        self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    async def _wait_for_slot(self):
+        while True:
+            now = time.monotonic()
+            if self.paused_until > now:
+                await asyncio.sleep(self.paused_until - now)
+                continue
+            delay = self._take_token(now)
+            if not delay:
+                return
+            await asyncio.sleep(delay)
+
+    async def _run(self):
+        while True:
+            entry = await self._get()
+            if entry[2].future.done():
+                continue  # вызывающий перестал ждать (таймаут)
+            await self._wait_for_slot()
+            # Пока ждали токен, мог прийти более срочный запрос - берём самый приоритетный
+            self._put(entry)
+            entry = await self._get()
+            if entry[2].future.done():
+                self.tokens += 1
+                continue
+            if not self._voice_ready(entry[2]):
+                self._switch_started = time.monotonic()
+                try:
+                    switched = await self._switch_voice(entry)
+                finally:
+                    self._switch_seconds = self.switch_seconds()
+                    self._switch_started = None
+                if not switched:
+                    continue
+            task = asyncio.create_task(self._send(entry))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _switch_voice(self, entry):
+        """
+        Переключает голос чата перед сообщением entry (слот отправки уже занят).
+        False - сообщение не отправляется сейчас (FloodWait - оно снова в очереди, или ошибка).
+        """
+        message = entry[2]
+        # Сообщения со старым голосом должны уйти раньше команды, а бот - ответить на них:
+        # он озвучивает текст, когда доходит до него, и ранняя команда сменила бы их голос
+        if self._tasks:
+            await asyncio.wait(list(self._tasks))
+        if self.before_switch is not None:
+            await self.before_switch()
+        if message.future.done():
+            return False  # вызывающий не дождался - переключаться незачем
+        try:
+            for index, command in enumerate(self.switch_commands(message.voice, self.voice)):
+                if index:
+                    await self._wait_for_slot()
+                await self.send_func(command)
+        except FloodWait as e:
+            self.flood_waits += 1
+            self.voice = None  # часть команд могла уйти
+            self.paused_until = max(self.paused_until, time.monotonic() + e.value + 1)
+            logger.warning(f"FloodWait {e.value} сек при переключении голоса.")
+            self._put(entry)
+            return False
+        except Exception as e:
+            self.voice = None
+            self.failed += 1
+            logger.error(f"Не удалось переключить голос на {message.voice}: {e}")
+            if not message.future.done():
+                message.future.set_exception(e)
+            return False
+        self.voice = message.voice.merged(self.voice)
+        self.voice_switches += 1
+        logger.info(f"Голос бота переключён: {self.voice}")
+        # Команды заняли слот - сообщение ждёт следующего
+        await self._wait_for_slot()
+        return True
+
+    async def _send(self, entry):
+        message = entry[2]
+        self.in_flight += 1
+        try:
+            message_id = await self.send_func(message.text)
+        except FloodWait as e:
+            self.flood_waits += 1
+            message.attempts += 1
+            self.paused_until = max(self.paused_until, time.monotonic() + e.value + 1)
+            logger.warning(f"FloodWait {e.value} сек: очередь отправки на паузе "
+                           f"(в очереди: {sum(self.queued.values())}).")
+            if message.attempts < MAX_ATTEMPTS and not message.future.done():
+                self._put(entry)
+                return
+            self.failed += 1
+            if not message.future.done():
+                message.future.set_exception(e)
+        except Exception as e:
+            self.failed += 1
+            if not message.future.done():
+                message.future.set_exception(e)
+        else:
+            self.sent += 1
+            if not message.future.done():
+                if message_id and message.on_sent:
+                    message.on_sent(message_id, resolve_voice(message.voice, self.voice))
+                message.future.set_result(message_id)
+        finally:
+            self.in_flight -= 1
+
+    def stats(self):
+        return {
+            "rate": self.rate, "burst": self.burst,
+            "queued": {LANES[priority]: count for priority, count in self.queued.items()},
+            "in_flight": self.in_flight, "sent": self.sent, "failed": self.failed,
+            "flood_waits": self.flood_waits,
+            "voice": str(self.voice) if self.voice else None, "voice_switches": self.voice_switches,
+            "switch_seconds": round(self.switch_seconds(), 1),
+            "paused_for": round(max(0.0, self.paused_until - time.monotonic()), 1),
+        }
@@ -0,0 +1,149 @@
+# --- Пул аккаунтов Telegram ---
+# Каждая сессия - отдельный аккаунт со своим клиентом Pyrogram, своим id бота и
+# своей очередью отправки (лимиты и FloodWait у каждого аккаунта свои). Запрос
+# уходит через наименее загруженную готовую сессию. id сообщений уникальны только
+# в пределах аккаунта, поэтому ответы бота сопоставляются по паре (сессия, id).
+# id бота для каждой сессии сохраняется в файл, чтобы при перезапуске не искать
+# бота по имени заново.
+
+import os
+import json
+import time
+import asyncio
+import logging
+
+from send_scheduler import SendScheduler
+from voice import SPEED_COMMAND, VOICE_COMMAND, resolve_voice, switch_commands
+
+logger = logging.getLogger("SessionPool")
+
+# Сколько секунд переключение голоса ждёт ответов бота на уже отправленные сообщения
+SWITCH_WAIT = 30
+SETTLE_POLL_INTERVAL = 0.1
+
+
+class TelegramSession:
+    def __init__(self, name, client, rate, burst, voice_command=VOICE_COMMAND, speed_command=SPEED_COMMAND):
+        self.name = name
+        self.client = client
+        self.bot_id = None
+        self.voice_command = voice_command
+        self.speed_command = speed_command
+        self.scheduler = SendScheduler(self.send_message, rate, burst, switch_commands=self.switch_commands)
+
+    def switch_commands(self, target, current):
+        """Голос - настройка чата этого аккаунта с ботом, поэтому состояние у каждой сессии своё."""
+        return switch_commands(target, current, self.voice_command, self.speed_command)
+
+    async def send_message(self, text):
+        """Непосредственная отправка; вызывается только очередью scheduler."""
+        sent_message = await self.client.send_message(chat_id=self.bot_id, text=text)
+        return sent_message.id
+
+    @property
+    def connected(self):
+        return self.client.is_connected
+
+    @property
+    def ready(self):
+        return self.client.is_connected and self.bot_id is not None
+
+    @property
+    def paused(self):
+        return self.scheduler.paused_until > time.monotonic()
+
+
+class SessionPool:
+    """
+    pending_table нужен для оценки загрузки (сколько ответов бота ждёт каждая сессия) и
+    для переключения голоса: оно ждёт этих ответов не дольше switch_wait секунд.
+    """
+
+    def __init__(self, pending_table, switch_wait=SWITCH_WAIT):
+        self.pending_table = pending_table
+        self.switch_wait = switch_wait
+        self.sessions = []
+
+    def add(self, session):
+        session.scheduler.before_switch = lambda: self.settle(session)
+        self.sessions.append(session)
+
+    async def settle(self, session):
+        """
+        Перед переключением голоса в чате session ждёт, пока бот ответит на отправленные
+        через неё сообщения (или их запросы снимут по таймауту). Иначе команда дошла бы до
+        бота раньше их текстов, и аудио с новым голосом попало бы в кэш под старым.
+        Не дождавшиеся за switch_wait запросы снимаются с ошибкой.
+        """
+        deadline = time.monotonic() + self.switch_wait
+        while self.pending_table.count_by_session().get(session.name) and time.monotonic() < deadline:
+            await asyncio.sleep(SETTLE_POLL_INTERVAL)
+        expired = self.pending_table.expire_session(session.name)
+        if expired:
+            logger.warning(f"Сессия '{session.name}': {expired} запросов без ответа снято перед переключением голоса.")
+
+    def connected_sessions(self):
+        return [session for session in self.sessions if session.connected]
+
+    def ready_sessions(self):
+        return [session for session in self.sessions if session.ready]
+
+    def load(self, session, awaiting=None):
+        """Сообщения в очереди отправки + отправленные, на которые бот ещё не ответил."""
+        if awaiting is None:
+            awaiting = self.pending_table.count_by_session()
+        scheduler = session.scheduler
+        return sum(scheduler.queued.values()) + scheduler.in_flight + awaiting.get(session.name, 0)
+
+    def pick(self, voice=None):
+        """
+        Наименее загруженная готовая сессия; сессии на паузе FloodWait - в последнюю очередь.
+        При равной загрузке - сессия, в чате которой уже выбран голос voice (без переключения).
+        """
+        candidates = self.ready_sessions()
+        if not candidates:
+            return None
+        awaiting = self.pending_table.count_by_session()
+        return min(candidates, key=lambda session: (
+            session.paused, self.load(session, awaiting),
+            voice is not None and not voice.satisfied_by(session.scheduler.voice)))
+
+    def resolve_voice(self, voice):
+        """
+        Настройка, которой бот озвучит запрос с голосом voice: незаданное берётся из
+        состояния чата сессии, которую сейчас выбрал бы pick().
+        """
+        session = self.pick(voice)
+        return resolve_voice(voice, session.scheduler.voice if session else None)
+
+    def stats(self):
+        awaiting = self.pending_table.count_by_session()
+        return {
+            session.name: dict(session.scheduler.stats(), ready=session.ready,
+                               awaiting_reply=awaiting.get(session.name, 0))
+            for session in self.sessions
+        }
+
+
+def load_bot_ids(path):
+    """{имя сессии: {имя бота: id}}, сохранённые при прошлых запусках."""
+    try:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        return data if isinstance(data, dict) else {}
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        logger.warning(f"Не удалось прочитать сохранённые id ботов из {path}: {e}")
+        return {}
+
+
+def save_bot_ids(path, bot_ids):
+    """Записывает файл целиком через временный, чтобы не оставить его обрезанным."""
+    tmp_path = f"{path}.tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(bot_ids, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.warning(f"Не удалось сохранить id ботов в {path}: {e}")
@@ -0,0 +1,53 @@
+# --- Деление длинного текста на куски для бота ---
+# Длинная строка уходит боту не одним сообщением, а несколькими кусками, которые
+# синтезируются параллельно и склеиваются (audio_convert.concat_audio). Делим по
+# границам предложений, внутри слишком длинного предложения - по частям (запятые,
+# точки с запятой, тире), затем по словам.
+
+import re
+
+SPLITTERS = (
+    re.compile(r"(?<=[.!?…])\s+"),
+    re.compile(r"(?<=[,;:—–])\s+"),
+    re.compile(r"\s+"),
+)
+
+
+def _pack(text, max_chars, level):
+    if len(text) <= max_chars:
+        return [text]
+    if level == len(SPLITTERS):
+        # Одно слово длиннее max_chars - режем как есть
+        return [text[i:i + max_chars] for i in range(0, len(text), max_chars)]
+
+    chunks = []
+    current = ""
+    for piece in SPLITTERS[level].split(text):
+        if not piece:
+            continue
+        candidate = f"{current} {piece}" if current else piece
+        if len(candidate) <= max_chars:
+            current = candidate
+            continue
+        if current:
+            chunks.append(current)
+        if len(piece) <= max_chars:
+            current = piece
+        else:
+            parts = _pack(piece, max_chars, level + 1)
+            chunks.extend(parts[:-1])
+            current = parts[-1]
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def split_text(text, max_chars):
+    """
+    Делит text на куски не длиннее max_chars, соседние короткие предложения
+    объединяются. max_chars <= 0 - не делить.
+    """
+    text = text.strip()
+    if max_chars <= 0 or len(text) <= max_chars:
+        return [text]
+    return _pack(text, max_chars, 0)
@@ -0,0 +1,1425 @@
+# --- Общая часть серверов TTS11.py и TITTS.py ---
+# Конфигурация, конвейер запроса (нормализация, кэш, очереди отправки боту, ожидание
+# голосового, конвертация), HTTP-обработчики и запуск сессий Telegram. Скрипты
+# импортируют модуль и вызывают main(); TITTS.py подключает чат Twitch через
+# text_hooks, startup_hooks и ready_checks.
+
+import os
+import sys
+import threading
+import asyncio
+import urllib.parse
+import logging
+import base64
+import time
+import concurrent.futures
+import uuid
+
+from dotenv import load_dotenv
+from flask import Flask, request, Response, jsonify, g
+from pyrogram import Client, filters
+from mystem_pool import MystemPool
+
+from audio_convert import AudioFormat, ConversionPool, ConversionQueueFull, OGG_PASSTHROUGH, concat_audio, convert_audio, iter_chunks, join_stream, stream_audio
+from audio_cache import AudioCache, VoiceIndex, make_cache_key
+from pending import PendingTable, PendingTableFull
+from admission import AdmissionControl, Overloaded
+from latency import LatencyTracker
+from voice import parse_voice_setting
+from send_scheduler import PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE
+from session_pool import SessionPool, TelegramSession, load_bot_ids, save_bot_ids
+from mock_bot import MockBotSession, load_voice
+from prewarm import PrewarmQueue, read_phrases
+from jobs import STATE_ERROR, JobStore, TooManyJobs
+from async_http import AIOHTTP_AVAILABLE, event_stream_response, start_server as start_async_http_server, stream_response, web
+from normalizer import expand_numbers
+from text_chunks import split_text
+from numeral_gender import correct_numeral_gender_mystem
+import gender_index
+import metrics
+
+# --- КОНФИГУРАЦИЯ ---
+# ENV_FILE - путь к файлу настроек (по умолчанию .env)
+load_dotenv(os.getenv("ENV_FILE"))
+
+# Запуск без консоли (служба, контейнер): настройки только из окружения и файла, без
+# вопросов через input(). Включается HEADLESS=1 или сам, если stdin - не терминал
+HEADLESS = os.getenv("HEADLESS", "").lower() in ("1", "true", "yes") or not (sys.stdin and sys.stdin.isatty())
+
+API_ID = os.getenv("API_ID")
+API_HASH = os.getenv("API_HASH")
+# Бэкенд синтеза: "telegram" - настоящий бот, "mock" - локальная заглушка бота (mock_bot.py)
+# для нагрузочных тестов без сети и без аккаунта Telegram
+TTS_BACKEND = os.getenv("TTS_BACKEND", "telegram").lower()
+
+# Проверка, заданы ли API_ID и API_HASH
+if TTS_BACKEND != "mock" and not HEADLESS and (not API_ID or not API_HASH):
+    print("Файл .env не найден или в нём отсутствуют API_ID и API_HASH.")
+    print("Получите их на https://my.telegram.org/apps и введите ниже:")
+
+    API_ID = input("Введите API_ID: ").strip()
+    API_HASH = input("Введите API_HASH: ").strip()
+
+    # Дописываем в .env (там же могут быть настройки скрипта, например Twitch)
+    with open(".env", "a") as f:
+        f.write(f"\nAPI_ID={API_ID}\n")
+        f.write(f"API_HASH={API_HASH}\n")
+
+    print("Настройки сохранены в .env.")
+
+# Преобразуем API_ID в int (он может быть строкой после input)
+API_ID = int(API_ID) if API_ID else None
+
+# Остальная часть конфигурации
+SESSION_NAME = "my_account"
+# Несколько аккаунтов Telegram через запятую (SESSION_NAMES=my_account,second): запросы
+# распределяются между ними, у каждого свои лимиты. Каждая сессия авторизуется при первом запуске
+SESSION_NAMES = [name.strip() for name in os.getenv("SESSION_NAMES", SESSION_NAME).split(",") if name.strip()]
+TARGET_BOT_USERNAME = "silero_voice_bot"
+FLASK_HOST = "127.0.0.1"
+FLASK_PORT = 8124
+RESPONSE_TIMEOUT = 30
+SEND_TIMEOUT = 20
+# Таймауты подстраиваются под наблюдаемую задержку бота для текстов такой же длины
+# (latency.py); RESPONSE_TIMEOUT и SEND_TIMEOUT - верхние пределы, *_MIN - нижние.
+# ADAPTIVE_TIMEOUTS=0 - всегда фиксированные
+ADAPTIVE_TIMEOUTS = os.getenv("ADAPTIVE_TIMEOUTS", "1").lower() in ("1", "true", "yes")
+RESPONSE_TIMEOUT_MIN = int(os.getenv("RESPONSE_TIMEOUT_MIN", 10))
+SEND_TIMEOUT_MIN = int(os.getenv("SEND_TIMEOUT_MIN", 5))
+# Голосовое, пришедшее после таймаута (но не позже LATE_REPLY_TTL секунд после отправки),
+# всё равно скачивается и кладётся в кэш - следующий такой же запрос отдастся сразу
+LATE_REPLY_TTL = int(os.getenv("LATE_REPLY_TTL", 300))
+# HTTP сервер: "flask" - Flask в отдельном потоке (по умолчанию),
+# "async" - aiohttp в цикле событий Telegram (нужен пакет aiohttp)
+HTTP_SERVER = os.getenv("HTTP_SERVER", "flask").lower()
+# id бота для каждой сессии, найденные при прошлых запусках (чтобы не вызывать get_users)
+BOT_IDS_FILE = "bot_ids.json"
+DEBUG_WAV_DIR = "debug_wavs"
+
+# Индекс рода словоформ (собирается из таблицы при первом запуске, см. gender_index.py)
+GENDER_INDEX_PATH = "gender_index.bin"
+GENDER_INDEX_SEED = os.path.join("data", "noun_genders.tsv")
+# Число процессов Mystem для параллельной нормализации
+MYSTEM_POOL_SIZE = int(os.getenv("MYSTEM_POOL_SIZE", min(4, os.cpu_count() or 1)))
+
+# Формат выходного аудио по умолчанию; клиент может переопределить его параметрами
+# запроса ?format=wav|pcm|ogg&rate=48000&width=16
+OUTPUT_CONTAINER = os.getenv("OUTPUT_CONTAINER", "wav")
+OUTPUT_SAMPLE_RATE = int(os.getenv("OUTPUT_SAMPLE_RATE", 128000))
+OUTPUT_SAMPLE_WIDTH = int(os.getenv("OUTPUT_SAMPLE_WIDTH", 2))
+DEFAULT_AUDIO_FORMAT = AudioFormat("wav", 128000, 2).with_options(OUTPUT_CONTAINER, OUTPUT_SAMPLE_RATE, OUTPUT_SAMPLE_WIDTH)
+# Пул конвертации аудио (вне цикла событий Telegram) и предел одновременных задач в нём
+# (остальные ждут; прежнее имя переменной - AUDIO_QUEUE_DEPTH). Ждущих не больше
+# AUDIO_MAX_WAITING (0 - без ограничения): запрос, которому не хватило места, получает 503
+AUDIO_WORKERS = int(os.getenv("AUDIO_WORKERS", 2))
+AUDIO_MAX_CONCURRENT = int(os.getenv("AUDIO_MAX_CONCURRENT", os.getenv("AUDIO_QUEUE_DEPTH", 16)))
+AUDIO_MAX_WAITING = int(os.getenv("AUDIO_MAX_WAITING", 64))
+
+# Кэш синтезированного аудио (ключ - нормализованный текст + формат вывода)
+AUDIO_CACHE_DIR = "audio_cache"
+AUDIO_CACHE_MEMORY_MB = int(os.getenv("AUDIO_CACHE_MEMORY_MB", 64))
+AUDIO_CACHE_DISK_MB = int(os.getenv("AUDIO_CACHE_DISK_MB", 512))
+# Сколько последних голосовых бота помнить по file_unique_id (повторные не скачиваются)
+VOICE_INDEX_MAX = int(os.getenv("VOICE_INDEX_MAX", 10000))
+
+# Текст длиннее CHUNK_MAX_CHARS делится по предложениям на куски, которые отправляются
+# боту параллельно и склеиваются с паузой CHUNK_SILENCE_MS между ними (0 - не делить)
+CHUNK_MAX_CHARS = int(os.getenv("CHUNK_MAX_CHARS", 200))
+CHUNK_SILENCE_MS = int(os.getenv("CHUNK_SILENCE_MS", 150))
+
+# Темп отправки сообщений боту для каждой сессии: в среднем SEND_RATE в секунду, пачкой
+# до SEND_BURST. При FloodWait очередь отправки сессии целиком встаёт на паузу (см. send_scheduler.py)
+SEND_RATE = float(os.getenv("SEND_RATE", 1.0))
+SEND_BURST = int(os.getenv("SEND_BURST", 5))
+
+# Голос и скорость озвучки (?voice=...&speed=...). Бот озвучивает текст голосом, выбранным
+# в чате командой, поэтому сервер сам отправляет VOICE_COMMAND/SPEED_COMMAND, когда голос
+# нужно сменить. DEFAULT_VOICE/DEFAULT_SPEED - для запросов без параметров (пусто - как
+# настроено в чате); VOICES - разрешённые голоса через запятую (пусто - любые)
+DEFAULT_VOICE = os.getenv("DEFAULT_VOICE", "")
+DEFAULT_SPEED = os.getenv("DEFAULT_SPEED", "")
+VOICES = [name.strip() for name in os.getenv("VOICES", "").split(",") if name.strip()]
+VOICE_COMMAND = os.getenv("VOICE_COMMAND", "/speaker {voice}")
+SPEED_COMMAND = os.getenv("SPEED_COMMAND", "/speed {speed}")
+DEFAULT_VOICE_SETTING = parse_voice_setting(DEFAULT_VOICE, DEFAULT_SPEED, VOICES)
+
+# Заглушка бота (TTS_BACKEND=mock): голосовое из файла MOCK_BOT_VOICE или тишина MOCK_BOT_VOICE_MS,
+# задержка ответа - логнормальная с медианой MOCK_BOT_LATENCY_MS, MOCK_BOT_DROP_RATE - доля без ответа
+MOCK_BOT_VOICE = os.getenv("MOCK_BOT_VOICE")
+MOCK_BOT_VOICE_MS = int(os.getenv("MOCK_BOT_VOICE_MS", 2000))
+MOCK_BOT_LATENCY_MS = float(os.getenv("MOCK_BOT_LATENCY_MS", 1500))
+MOCK_BOT_LATENCY_SIGMA = float(os.getenv("MOCK_BOT_LATENCY_SIGMA", 0.3))
+MOCK_BOT_DROP_RATE = float(os.getenv("MOCK_BOT_DROP_RATE", 0))
+
+# Прогрев кэша: фразы из PREWARM_FILE (по одной на строку) синтезируются в фоне при запуске,
+# POST /synthesize/batch добавляет пачки во время работы. PREWARM_WORKERS - сколько фраз
+# синтезируется одновременно; сообщения боту уходят после интерактивных запросов
+PREWARM_FILE = os.getenv("PREWARM_FILE")
+PREWARM_WORKERS = int(os.getenv("PREWARM_WORKERS", 2))
+BATCH_MAX_TEXTS = int(os.getenv("BATCH_MAX_TEXTS", 1000))
+
+# Асинхронные задания (POST /jobs): состояние хранится JOB_TTL секунд после завершения (аудио - в кэше),
+# всего не больше JOBS_MAX заданий, выполняющихся от одного клиента - не больше
+# JOBS_MAX_PER_CLIENT. SSE_KEEPALIVE - интервал пустых событий в /jobs/events, поток
+# закрывается через SSE_MAX_LIFETIME секунд (под Flask он занимает поток сервера)
+JOB_TTL = int(os.getenv("JOB_TTL", 600))
+JOBS_MAX = int(os.getenv("JOBS_MAX", 1000))
+JOBS_MAX_PER_CLIENT = int(os.getenv("JOBS_MAX_PER_CLIENT", 100))
+SSE_KEEPALIVE = 15
+SSE_MAX_LIFETIME = int(os.getenv("SSE_MAX_LIFETIME", 300))
+
+# Защита от перегрузки: одновременно ждущих ответа бота запросов не больше MAX_IN_FLIGHT,
+# от одного клиента - не больше MAX_PER_CLIENT, разных текстов в ожидании - не больше
+# PENDING_MAX (0 - без ограничения). Лишние сразу получают 503 с Retry-After: OVERLOAD_RETRY_AFTER
+MAX_IN_FLIGHT = int(os.getenv("MAX_IN_FLIGHT", 64))
+MAX_PER_CLIENT = int(os.getenv("MAX_PER_CLIENT", 16))
+PENDING_MAX = int(os.getenv("PENDING_MAX", 256))
+OVERLOAD_RETRY_AFTER = int(os.getenv("OVERLOAD_RETRY_AFTER", 5))
+# Записи в ожидании дольше PENDING_TTL секунд (ожидающий пропал, бот не ответил) удаляются
+PENDING_TTL = int(os.getenv("PENDING_TTL", 120))
+PENDING_SWEEP_INTERVAL = 30
+
+os.makedirs(DEBUG_WAV_DIR, exist_ok=True)
+
+# --- Настройки логирования ---
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s - %(levelname)s - %(threadName)s (%(funcName)s) - %(message)s')
+logger = logging.getLogger(__name__)
+
+# --- Глобальные переменные ---
+telegram_loop = None
+pending_requests = PendingTable(PENDING_MAX, LATE_REPLY_TTL)  # Запросы, ожидающие ответа бота (по сессии и id сообщения)
+admission = AdmissionControl(MAX_IN_FLIGHT, MAX_PER_CLIENT, OVERLOAD_RETRY_AFTER)  # Лимиты ждущих запросов
+bot_latency = LatencyTracker(RESPONSE_TIMEOUT_MIN, RESPONSE_TIMEOUT)  # Отправка -> голосовое, по длине текста
+send_latency = LatencyTracker(SEND_TIMEOUT_MIN, SEND_TIMEOUT, bounds=())  # Очередь отправки -> send_message
+session_pool = SessionPool(pending_requests, RESPONSE_TIMEOUT)  # Аккаунты Telegram (клиент, id бота, очередь отправки)
+conversion_pool = ConversionPool(AUDIO_WORKERS, AUDIO_MAX_CONCURRENT, AUDIO_MAX_WAITING)
+audio_cache = AudioCache(AUDIO_CACHE_DIR,
+                         memory_max_bytes=AUDIO_CACHE_MEMORY_MB * 1024 * 1024,
+                         disk_max_bytes=AUDIO_CACHE_DISK_MB * 1024 * 1024)
+voice_index = VoiceIndex(VOICE_INDEX_MAX)
+
+# Расширения скриптов (TITTS.py - чат Twitch): text_hooks - корутины, получающие нормализованный
+# текст каждого запроса /synthesize/; startup_hooks - корутины, запускаемые вместе с сессиями
+# Telegram; ready_checks - дополнительные поля /readyz (имя -> функция без аргументов)
+text_hooks = []
+startup_hooks = []
+ready_checks = {}
+
+# Метрики, которые считают сами компоненты, отдаются в /metrics при запросе
+metrics.counter_callback("tts_cache_hits_total", "Попадания в кэш аудио (память и диск)",
+                         lambda: audio_cache.hits_memory + audio_cache.hits_disk)
+metrics.counter_callback("tts_cache_misses_total", "Промахи кэша аудио", lambda: audio_cache.misses)
+metrics.gauge_callback("tts_pending_requests", "Запросы в таблице ожидания ответа бота", lambda: len(pending_requests))
+metrics.gauge_callback("tts_in_flight_requests", "HTTP-запросы, ждущие ответа бота", lambda: admission.in_flight)
+metrics.counter_callback("tts_pending_swept_total", "Записи, удалённые из таблицы ожидания по возрасту",
+                         lambda: pending_requests.swept)
+metrics.counter_callback("tts_flood_waits_total", "FloodWait от Telegram (все сессии)",
+                         lambda: sum(session.scheduler.flood_waits for session in session_pool.sessions))
+metrics.gauge_callback("tts_send_queue_depth", "Сообщения в очередях отправки боту (все сессии)",
+                       lambda: sum(sum(session.scheduler.queued.values()) for session in session_pool.sessions))
+metrics.gauge_callback("tts_conversion_queue_depth", "Задачи конвертации в работе и в очереди",
+                       lambda: conversion_pool.in_progress + conversion_pool.waiting)
+
+# Пул Mystem (несколько процессов для параллельных запросов) запускается в фоне
+# (warm_up_mystem), чтобы не задерживать старт; пока он не готов, род берётся только из индекса
+mystem = None
+mystem_state = "starting"  # starting -> ready / unavailable
+start_time = time.time()
+bot_ids = load_bot_ids(BOT_IDS_FILE)
+
+
+def warm_up_mystem():
+    global mystem, mystem_state
+    # Используем try-except на случай, если Mystem не установлен или не найден
+    try:
+        mystem = MystemPool(MYSTEM_POOL_SIZE)
+        mystem_state = "ready"
+        logger.info("Mystem инициализирован успешно.")
+    except Exception as e:
+        mystem_state = "unavailable"
+        logger.error(f"Не удалось инициализировать Mystem: {e}. Коррекция рода будет работать только по индексу рода.")
+
+noun_gender_index = gender_index.load_or_build(GENDER_INDEX_PATH, GENDER_INDEX_SEED)
+
+# --- Инициализация Flask ---
+app = Flask(__name__)
+
+# --- Логика Flask ---
+
+def apply_numeral_gender(text):
+    """Коррекция рода числительных: индекс рода, а Mystem (если доступен) - для остальных слов."""
+    if not mystem and not noun_gender_index:
+        logger.warning("Ни Mystem, ни индекс рода недоступны, коррекция рода пропускается.")
+        return text
+    return correct_numeral_gender_mystem(text, mystem, noun_gender_index)
+
+
+def run_text_hooks(text, req_logger):
+    """Запускает text_hooks для текста запроса в цикле событий Telegram, не дожидаясь их."""
+    if not text_hooks:
+        return
+    if not (telegram_loop and telegram_loop.is_running()):
+        req_logger.error("Цикл событий не запущен, обработчики текста (text_hooks) пропущены.")
+        return
+    for hook in text_hooks:
+        asyncio.run_coroutine_threadsafe(hook(text), telegram_loop)
+
+
+def error_text(e):
+    """Текст исключения для ответа клиенту; у некоторых (например, TimeoutError()) он пустой."""
+    return str(e) or type(e).__name__
+
+
+class RequestError(Exception):
+    """Ошибка обработки запроса, которую нужно вернуть клиенту с кодом status."""
+    def __init__(self, message, status, retry_after=None):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+        self.retry_after = retry_after  # секунды для заголовка Retry-After (перегрузка)
+
+
+def admit_request(client, req_logger):
+    """Допуск запроса, который будет ждать бота; при перегрузке - RequestError 503 с Retry-After."""
+    try:
+        admission.acquire(client)
+    except Overloaded as e:
+        metrics.REJECTED.inc(e.reason)
+        req_logger.warning(f"Запрос от {client} отклонён: {e.message}")
+        raise RequestError(e.message, 503, retry_after=e.retry_after)
+
+
+def acquire_pending(text, audio_format, req_logger, voice=None):
+    """pending_requests.acquire; если таблица ожидания заполнена - RequestError 503 с Retry-After."""
+    try:
+        return pending_requests.acquire(text, audio_format, voice)
+    except PendingTableFull as e:
+        metrics.REJECTED.inc("pending_full")
+        req_logger.warning(f"Запрос отклонён: {e}")
+        raise RequestError("Сервер перегружен, повторите запрос позже", 503, retry_after=OVERLOAD_RETRY_AFTER)
+
+
+def send_error(e, req_logger):
+    """
+    RequestError для неудачной отправки боту. Очередь отправки не успела отправить
+    сообщение за таймаут - это перегрузка, поэтому 503 с Retry-After, как при отказе в допуске.
+    """
+    if isinstance(e, (asyncio.TimeoutError, concurrent.futures.TimeoutError, TimeoutError)):
+        metrics.TIMEOUTS.inc("telegram_send")
+        metrics.REJECTED.inc("send_timeout")
+        req_logger.warning(f"Сообщение не отправлено боту вовремя: {e}")
+        return RequestError("Таймаут очереди отправки боту: сервер перегружен, повторите запрос позже",
+                            503, retry_after=OVERLOAD_RETRY_AFTER)
+    req_logger.error(f"Ошибка при отправке сообщения боту: {e!r}")
+    return RequestError(f"Ошибка отправки в Telegram: {error_text(e)}", 500)
+
+
+async def convert_in_pool(ogg_bytes, audio_format):
+    """conversion_pool.convert; если очередь конвертации заполнена - RequestError 503 с Retry-After."""
+    try:
+        return await conversion_pool.convert(ogg_bytes, audio_format)
+    except ConversionQueueFull as e:
+        metrics.REJECTED.inc("conversion_queue")
+        raise RequestError(f"Сервер перегружен ({e}), повторите запрос позже", 503, retry_after=OVERLOAD_RETRY_AFTER) from e
+
+
+def extract_request_text(text, query_string, req_logger):
+    """Достаёт текст из пути или параметров запроса и декодирует его."""
+    if not text:
+        qs = query_string
+        if qs:
+            args = urllib.parse.parse_qs(qs)
+            text_param = args.get('text', [None])[0]
+            if text_param:
+                text = text_param
+            else:
+                text = qs
+    if not text:
+        req_logger.error("Текст не найден ни в пути, ни в параметрах.")
+        raise RequestError("Текст не предоставлен", 400)
+    try:
+        decoded_text = urllib.parse.unquote(text).strip()
+    except Exception as e:
+        req_logger.error(f"Ошибка декодирования URL: {e}")
+        raise RequestError("Ошибка декодирования текста", 400)
+    if not decoded_text:
+        req_logger.error("Пустой текст после декодирования.")
+        raise RequestError("Пустой текст после декодирования", 400)
+    req_logger.info(f"Оригинальный декодированный текст: '{decoded_text}'")
+    return decoded_text
+
+
+def parse_audio_format(args, req_logger):
+    try:
+        return DEFAULT_AUDIO_FORMAT.with_options(args.get('format'), args.get('rate'), args.get('width'))
+    except ValueError as e:
+        req_logger.error(f"Неверные параметры формата аудио: {e}")
+        raise RequestError(str(e), 400)
+
+
+def parse_voice(args, req_logger):
+    """
+    Голос и скорость из ?voice=&speed=; то, что не задано, берётся из DEFAULT_VOICE и
+    DEFAULT_SPEED, а затем из текущего состояния чата с ботом (session_pool.resolve_voice):
+    ключ кэша строится по голосу, которым бот озвучит текст. None - голос не задан и неизвестен.
+    """
+    try:
+        requested = parse_voice_setting(args.get('voice'), args.get('speed'), VOICES)
+    except ValueError as e:
+        req_logger.error(f"Неверные параметры голоса: {e}")
+        raise RequestError(str(e), 400)
+    voice = DEFAULT_VOICE_SETTING if requested is None else requested.merged(DEFAULT_VOICE_SETTING)
+    return session_pool.resolve_voice(voice)
+
+
+def normalize_text(decoded_text, req_logger):
+    """Этапы нормализации: числа словами (num2words) и коррекция рода (Mystem)."""
+    # --- Этап 1: Замена чисел на слова (num2words) ---
+    text_after_num2words = decoded_text
+    try:
+        with metrics.STAGE_SECONDS.time("num2words"):
+            processed_text_stage1 = expand_numbers(decoded_text)
+
+        if processed_text_stage1 != decoded_text:
+            req_logger.info(f"Текст после num2words: '{processed_text_stage1}'")
+            text_after_num2words = processed_text_stage1
+        else:
+            req_logger.info("Числа для замены (num2words) в тексте не найдены.")
+
+    except Exception as e:
+        req_logger.error(f"Ошибка на этапе num2words: {e}", exc_info=True)
+        # text_after_num2words останется decoded_text
+
+
+    # --- Этап 2: Коррекция рода числительных 1 и 2 (Mystem) ---
+    text_to_send_to_bot = text_after_num2words
+    try:
+        with metrics.STAGE_SECONDS.time("mystem"):
+            processed_text_stage2 = apply_numeral_gender(text_after_num2words)
+
+        if processed_text_stage2 != text_after_num2words:
+            req_logger.info(f"Текст после коррекции рода (Mystem): '{processed_text_stage2}'")
+            text_to_send_to_bot = processed_text_stage2
+        else:
+             req_logger.info("Коррекция рода для 'один'/'два' (Mystem) не применялась или не потребовалась.")
+
+    except Exception as e:
+        # Ловим ошибки именно этапа коррекции
+        req_logger.error(f"Ошибка на этапе коррекции рода (Mystem): {e}", exc_info=True)
+        req_logger.warning("Отправка текста после этапа num2words из-за ошибки коррекции рода.")
+        # text_to_send_to_bot уже содержит text_after_num2words
+
+    return text_to_send_to_bot
+
+
+def check_telegram_ready(req_logger):
+    if not session_pool.connected_sessions():
+        req_logger.error("Ни один клиент Pyrogram не готов.")
+        raise RequestError("Клиент Telegram не готов", 503)
+    if not session_pool.ready_sessions():
+        req_logger.error("ID целевого бота не определен ни в одной сессии.")
+        raise RequestError("Не удалось определить ID бота", 500)
+    if not telegram_loop or not telegram_loop.is_running():
+        req_logger.error("Цикл событий Telegram не запущен.")
+        raise RequestError("Внутренняя ошибка сервера (event loop)", 500)
+
+
+def response_timeout(text):
+    """Сколько ждать голосовое бота на text."""
+    return bot_latency.deadline(len(text)) if ADAPTIVE_TIMEOUTS else RESPONSE_TIMEOUT
+
+
+def send_timeout():
+    return send_latency.deadline(0) if ADAPTIVE_TIMEOUTS else SEND_TIMEOUT
+
+
+def wants_stream(args):
+    """?stream=1 - отдать аудио бинарно (audio/wav или PCM) кусками, без base64."""
+    return str(args.get('stream', '')).lower() in ('1', 'true', 'yes')
+
+
+def check_result(request_data, req_logger):
+    request_key = request_data.text
+    error_result = request_data.error
+    if error_result:
+        req_logger.error(f"Получена ошибка от обработчика для '{request_key}': {error_result}")
+        raise error_result
+    if not request_data.result:
+        req_logger.error(f"Событие для '{request_key}' установлено, но нет ни результата, ни ошибки!")
+        raise Exception("Внутренняя ошибка: нет результата после события.")
+
+
+def result_cache_key(request_data, audio_format):
+    """Ключ кэша для ответа бота - по голосу, с которым ушло сообщение (sent_voice), а не по требованию."""
+    return make_cache_key(request_data.text, audio_format.key, request_data.sent_voice)
+
+
+def take_result_audio(request_data, audio_format, req_logger):
+    """Достаёт аудио нужного формата из завершённого запроса и кладёт его в кэш."""
+    check_result(request_data, req_logger)
+    audio_data = request_data.result.get(audio_format.key)
+    if audio_data is None:
+        # Формат, добавленный после конвертации (поздний ожидающий), конвертируем здесь
+        with metrics.STAGE_SECONDS.time("convert"):
+            audio_data = convert_audio(request_data.result[OGG_PASSTHROUGH.key], audio_format)
+    audio_cache.put(result_cache_key(request_data, audio_format), audio_data)
+    return audio_data
+
+
+def stream_and_cache(ogg_bytes, audio_format, cache_key):
+    """Отдаёт куски по мере конвертации; собранный файл кладётся в кэш после последнего куска."""
+    chunks = []
+    for chunk in stream_audio(ogg_bytes, audio_format):
+        chunks.append(chunk)
+        yield chunk
+    audio_cache.put(cache_key, join_stream(chunks, audio_format))
+
+
+def stream_result_audio(request_data, audio_format, req_logger):
+    """
+    Потоковый вариант take_result_audio: возвращает генератор кусков. Ошибка запроса
+    поднимается сразу, до начала ответа. Если формат уже сконвертирован другим
+    ожидающим, отдаются готовые байты.
+    """
+    check_result(request_data, req_logger)
+    cache_key = result_cache_key(request_data, audio_format)
+    audio_data = request_data.result.get(audio_format.key)
+    if audio_data is not None:
+        audio_cache.put(cache_key, audio_data)
+        return iter_chunks(audio_data)
+    return stream_and_cache(request_data.result[OGG_PASSTHROUGH.key], audio_format, cache_key)
+
+
+def split_for_bot(text, audio_format):
+    """Куски текста для бота. Голосовые OGG без перекодирования не склеить, поэтому их не делим."""
+    if audio_format.container == "ogg":
+        return [text]
+    return split_text(text, CHUNK_MAX_CHARS)
+
+
+def encode_base64(audio_data):
+    with metrics.STAGE_SECONDS.time("base64"):
+        return base64.b64encode(audio_data).decode("utf-8")
+
+
+def error_response(message, status, retry_after=None):
+    response = jsonify({"status": "error", "message": message})
+    if retry_after:
+        response.headers["Retry-After"] = str(retry_after)
+    return response, status
+
+
+def async_error_response(message, status, retry_after=None):
+    headers = {"Retry-After": str(retry_after)} if retry_after else None
+    return web.json_response({"status": "error", "message": message}, status=status, headers=headers)
+
+
+def audio_response(audio_data, audio_format, stream):
+    if stream:
+        return Response(iter_chunks(audio_data), mimetype=audio_format.mimetype,
+                        headers={"Content-Length": str(len(audio_data))})
+    return Response(encode_base64(audio_data), mimetype="text/plain")
+
+
+async def async_audio_response(audio_data, audio_format, stream):
+    if stream:
+        return web.Response(body=audio_data, headers={"Content-Type": audio_format.mimetype})
+    loop = asyncio.get_running_loop()
+    audio_base64_string = await loop.run_in_executor(None, encode_base64, audio_data)
+    return web.Response(text=audio_base64_string, content_type="text/plain")
+
+
+@app.route('/synthesize/', methods=['GET'])
+@app.route('/synthesize/<path:text>', methods=['GET'])
+def handle_synthesize_request(text=''):
+    global telegram_loop, pending_requests
+
+    current_thread_name = threading.current_thread().name
+    req_logger = logging.getLogger(current_thread_name)
+    request_start_time = time.time()
+    req_logger.info(f"Получен запрос на /synthesize/ от {request.remote_addr}")
+
+    try:
+        decoded_text = extract_request_text(text, request.query_string.decode('utf-8', errors='ignore'), req_logger)
+        audio_format = parse_audio_format(request.args, req_logger)
+        voice = parse_voice(request.args, req_logger)
+    except RequestError as e:
+        return error_response(e.message, e.status)
+    stream = wants_stream(request.args)
+
+    text_to_send_to_bot = normalize_text(decoded_text, req_logger)
+    run_text_hooks(text_to_send_to_bot, req_logger)
+
+    # --- Проверка кэша аудио ---
+    cache_key = make_cache_key(text_to_send_to_bot, audio_format.key, voice)
+    cached_audio = audio_cache.get(cache_key)
+    if cached_audio:
+        total_time = time.time() - request_start_time
+        req_logger.info(f"Аудио для '{text_to_send_to_bot}' найдено в кэше ({len(cached_audio)} байт), время: {total_time:.3f} сек.")
+        return audio_response(cached_audio, audio_format, stream)
+
+    # --- Проверки готовности и отправка ---
+    try:
+        check_telegram_ready(req_logger)
+        admit_request(request.remote_addr, req_logger)
+    except RequestError as e:
+        return error_response(e.message, e.status, e.retry_after)
+    g.admitted_client = request.remote_addr  # снимается в release_admission
+
+    # --- Длинный текст: куски параллельно, затем склейка ---
+    chunks = split_for_bot(text_to_send_to_bot, audio_format)
+    if len(chunks) > 1:
+        req_logger.info(f"Текст разбит на {len(chunks)} кусков, синтезируем параллельно.")
+        chunks_future = asyncio.run_coroutine_threadsafe(synthesize_chunks_async(text_to_send_to_bot, chunks, audio_format, voice=voice), telegram_loop)
+        try:
+            audio_data, _ = chunks_future.result(timeout=SEND_TIMEOUT + session_pool.switch_wait + RESPONSE_TIMEOUT)
+        except (asyncio.TimeoutError, concurrent.futures.TimeoutError):
+            metrics.TIMEOUTS.inc("chunks")
+            chunks_future.cancel()
+            req_logger.error(f"Таймаут ожидания ответа от бота для текста: '{text_to_send_to_bot}'")
+            return error_response("Таймаут ожидания ответа от бота", 504)
+        except RequestError as e:
+            return error_response(e.message, e.status, e.retry_after)
+        except Exception as e:
+            req_logger.error(f"Ошибка синтеза по кускам для '{text_to_send_to_bot}': {e}", exc_info=True)
+            return error_response(f"Ошибка обработки: {error_text(e)}", 500)
+        total_time = time.time() - request_start_time
+        req_logger.info(f"Общее время обработки запроса ({len(chunks)} кусков): {total_time:.2f} сек.")
+        return audio_response(audio_data, audio_format, stream)
+
+    request_key = text_to_send_to_bot
+    loop = telegram_loop
+
+    # Одинаковые тексты в полёте объединяются: повторный запрос не отправляется боту,
+    # а ждёт результата уже отправленного (single-flight).
+    # Потоковый запрос конвертирует сам, поэтому от обработчика ему нужен только OGG.
+    try:
+        request_data, is_owner = acquire_pending(request_key, OGG_PASSTHROUGH if stream else audio_format, req_logger, voice)
+    except RequestError as e:
+        return error_response(e.message, e.status, e.retry_after)
+    if not is_owner:
+        req_logger.info(f"Запрос '{request_key}' уже в обработке, ожидаем его результат (ожидающих: {request_data.waiters}).")
+    else:
+        req_logger.info(f"Запрос '{request_key}' добавлен в ожидание.")
+        req_logger.info(f"Отправка текста '{text_to_send_to_bot}' боту {TARGET_BOT_USERNAME}")
+        # Таймаут отправки соблюдает очередь: время переключения голоса в него не входит
+        send_future = asyncio.run_coroutine_threadsafe(dispatch_pending_request(request_data, timeout=send_timeout()), loop)
+        try:
+            message_id = send_future.result()
+            if not message_id:
+                raise Exception("Не удалось отправить сообщение боту (async задача не вернула id сообщения).")
+            req_logger.info(f"Сообщение успешно отправлено боту (id {message_id}).")
+        except Exception as e:
+            error = send_error(e, req_logger)
+            # Будим присоединившихся ожидающих, чтобы они не ждали таймаута
+            pending_requests.complete(request_data, error=error)
+            pending_requests.release(request_data)
+            return error_response(error.message, error.status, error.retry_after)
+
+
+    # --- Ожидание результата ---
+    try:
+        wait_timeout = response_timeout(request_key)
+        req_logger.info(f"Ожидание ответа для '{request_key}' (таймаут: {wait_timeout:.1f} сек)")
+        event_was_set = request_data.event.wait(timeout=wait_timeout)
+
+        if event_was_set:
+            req_logger.info(f"Событие для '{request_key}' получено.")
+            if stream:
+                req_logger.info(f"Потоковая отдача '{request_key}' в формате {audio_format.key}.")
+                return Response(stream_result_audio(request_data, audio_format, req_logger),
+                                mimetype=audio_format.mimetype)
+            audio_data = take_result_audio(request_data, audio_format, req_logger)
+            audio_base64_string = encode_base64(audio_data)
+            req_logger.info(f"Получена строка Base64 для '{request_key}' (длина: {len(audio_base64_string)} символов)")
+            total_time = time.time() - request_start_time
+            req_logger.info(f"Общее время обработки запроса '{request_key}': {total_time:.2f} сек.")
+            return Response(audio_base64_string, mimetype="text/plain")
+
+        else: # event_was_set is False
+            metrics.TIMEOUTS.inc("bot_wait")
+            req_logger.error(f"Таймаут ожидания ответа от бота для текста: '{request_key}'")
+            return error_response("Таймаут ожидания ответа от бота", 504)
+
+    except RequestError as e:
+        return error_response(e.message, e.status, e.retry_after)
+    except Exception as e:
+        req_logger.error(f"Ошибка во время ожидания или обработки ответа для '{request_key}': {e}", exc_info=True)
+        return error_response(f"Ошибка обработки: {error_text(e)}", 500)
+    finally:
+        # Гарантированно снимаем ожидающего; последний удаляет запрос из таблицы
+        if pending_requests.release(request_data):
+            req_logger.info(f"Запрос '{request_key}' удален из ожидания (в finally).")
+
+
+async def handle_synthesize_async(http_request):
+    """
+    /synthesize/ для асинхронного сервера (HTTP_SERVER=async): тот же контракт, что и у
+    Flask-обработчика, но корутина в цикле событий Telegram, ожидающая asyncio.Future.
+    """
+    req_logger = logging.getLogger("AsyncHTTP")
+    request_start_time = time.time()
+    loop = asyncio.get_running_loop()
+    req_logger.info(f"Получен запрос на /synthesize/ от {http_request.remote}")
+
+    try:
+        decoded_text = extract_request_text(http_request.match_info.get('text', ''), http_request.rel_url.raw_query_string, req_logger)
+        audio_format = parse_audio_format(http_request.query, req_logger)
+        voice = parse_voice(http_request.query, req_logger)
+    except RequestError as e:
+        return async_error_response(e.message, e.status)
+    stream = wants_stream(http_request.query)
+
+    # Нормализация и чтение кэша с диска - блокирующие операции, выполняем в пуле потоков
+    text_to_send_to_bot = await loop.run_in_executor(None, normalize_text, decoded_text, req_logger)
+    run_text_hooks(text_to_send_to_bot, req_logger)
+    cache_key = make_cache_key(text_to_send_to_bot, audio_format.key, voice)
+    cached_audio = await loop.run_in_executor(None, audio_cache.get, cache_key)
+    if cached_audio:
+        req_logger.info(f"Аудио для '{text_to_send_to_bot}' найдено в кэше ({len(cached_audio)} байт).")
+        return await async_audio_response(cached_audio, audio_format, stream)
+
+    try:
+        check_telegram_ready(req_logger)
+        admit_request(http_request.remote, req_logger)
+    except RequestError as e:
+        return async_error_response(e.message, e.status, e.retry_after)
+    http_request["admitted_client"] = http_request.remote  # снимается в release_admission_async
+
+    chunks = split_for_bot(text_to_send_to_bot, audio_format)
+    if len(chunks) > 1:
+        req_logger.info(f"Текст разбит на {len(chunks)} кусков, синтезируем параллельно.")
+        try:
+            audio_data, _ = await synthesize_chunks_async(text_to_send_to_bot, chunks, audio_format, voice=voice)
+        except asyncio.TimeoutError:
+            metrics.TIMEOUTS.inc("chunks")
+            req_logger.error(f"Таймаут ожидания ответа от бота для текста: '{text_to_send_to_bot}'")
+            return async_error_response("Таймаут ожидания ответа от бота", 504)
+        except RequestError as e:
+            return async_error_response(e.message, e.status, e.retry_after)
+        except Exception as e:
+            req_logger.error(f"Ошибка синтеза по кускам для '{text_to_send_to_bot}': {e}", exc_info=True)
+            return async_error_response(f"Ошибка обработки: {error_text(e)}", 500)
+        return await async_audio_response(audio_data, audio_format, stream)
+
+    request_key = text_to_send_to_bot
+    try:
+        request_data, is_owner = acquire_pending(request_key, OGG_PASSTHROUGH if stream else audio_format, req_logger, voice)
+    except RequestError as e:
+        return async_error_response(e.message, e.status, e.retry_after)
+    if is_owner:
+        req_logger.info(f"Отправка текста '{request_key}' боту {TARGET_BOT_USERNAME}")
+        try:
+            message_id = await dispatch_pending_request(request_data, timeout=send_timeout())
+            if not message_id:
+                raise Exception("Не удалось отправить сообщение боту (async задача не вернула id сообщения).")
+        except Exception as e:
+            error = send_error(e, req_logger)
+            pending_requests.complete(request_data, error=error)
+            pending_requests.release(request_data)
+            return async_error_response(error.message, error.status, error.retry_after)
+
+    try:
+        await asyncio.wait_for(pending_requests.wait_async(request_data), response_timeout(request_key))
+        if stream:
+            chunks = stream_result_audio(request_data, audio_format, req_logger)
+            return await stream_response(http_request, chunks, audio_format.mimetype)
+        audio_data = await loop.run_in_executor(None, take_result_audio, request_data, audio_format, req_logger)
+        audio_base64_string = await loop.run_in_executor(None, encode_base64, audio_data)
+        total_time = time.time() - request_start_time
+        req_logger.info(f"Общее время обработки запроса '{request_key}': {total_time:.2f} сек.")
+        return web.Response(text=audio_base64_string, content_type="text/plain")
+    except asyncio.TimeoutError:
+        metrics.TIMEOUTS.inc("bot_wait")
+        req_logger.error(f"Таймаут ожидания ответа от бота для текста: '{request_key}'")
+        return async_error_response("Таймаут ожидания ответа от бота", 504)
+    except RequestError as e:
+        return async_error_response(e.message, e.status, e.retry_after)
+    except Exception as e:
+        req_logger.error(f"Ошибка во время ожидания или обработки ответа для '{request_key}': {e}", exc_info=True)
+        return async_error_response(f"Ошибка обработки: {error_text(e)}", 500)
+    finally:
+        pending_requests.release(request_data)
+
+
+@app.before_request
+def start_request_timer():
+    g.request_start_time = time.perf_counter()
+
+
+@app.teardown_request
+def release_admission(exc):
+    client = g.pop('admitted_client', None)
+    if client is not None:
+        admission.release(client)
+
+
+@app.after_request
+def count_synthesize_response(response):
+    # Считаются только ответы /synthesize/; при HTTP_SERVER=async его считает count_responses
+    if is_synthesize_path(request.path):
+        observe_response(response.status_code, time.perf_counter() - g.request_start_time)
+    return response
+
+
+def is_synthesize_path(path):
+    return path.startswith('/synthesize') and path != '/synthesize/batch'
+
+
+def observe_response(status, seconds):
+    metrics.HTTP_RESPONSES.inc(str(status))
+    metrics.REQUEST_SECONDS.observe(str(status), seconds)
+
+
+@app.route('/healthz', methods=['GET'])
+def handle_healthz():
+    """Процесс жив и HTTP-сервер отвечает."""
+    return jsonify({"status": "ok", "uptime": round(time.time() - start_time, 1)})
+
+@app.route('/readyz', methods=['GET'])
+def handle_readyz():
+    """
+    Готовность к синтезу: нужен цикл событий и хотя бы одна сессия с известным id бота.
+    Mystem не обязателен (без него род определяется по индексу), но его состояние видно.
+    """
+    loop_running = bool(telegram_loop and telegram_loop.is_running())
+    ready_sessions = session_pool.ready_sessions()
+    ready = loop_running and bool(ready_sessions)
+    return jsonify({
+        "status": "ready" if ready else "not_ready",
+        "uptime": round(time.time() - start_time, 1),
+        "event_loop": loop_running,
+        "telegram": {"ready": [session.name for session in ready_sessions], "total": len(session_pool.sessions)},
+        "mystem": mystem_state,
+        "gender_index": noun_gender_index is not None,
+        **{name: check() for name, check in ready_checks.items()},
+    }), 200 if ready else 503
+
+@app.route('/metrics', methods=['GET'])
+def handle_metrics():
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+@app.route('/cache/stats', methods=['GET'])
+def handle_cache_stats():
+    return jsonify(dict(audio_cache.stats(), voice_index_entries=len(voice_index)))
+
+@app.route('/send/stats', methods=['GET'])
+def handle_send_stats():
+    return jsonify(session_pool.stats())
+
+@app.route('/timeouts/stats', methods=['GET'])
+def handle_timeouts_stats():
+    return jsonify({"adaptive": ADAPTIVE_TIMEOUTS, "response": bot_latency.stats(), "send": send_latency.stats()})
+
+@app.route('/admission/stats', methods=['GET'])
+def handle_admission_stats():
+    return jsonify(dict(admission.stats(), pending=len(pending_requests), pending_max=PENDING_MAX,
+                        pending_rejected=pending_requests.rejected, pending_swept=pending_requests.swept,
+                        conversion=conversion_pool.stats()))
+
+@app.route('/synthesize/batch', methods=['POST'])
+def handle_synthesize_batch():
+    """
+    Фоновый синтез списка текстов в кэш: JSON {"texts": [...], "format": ..., "rate": ..., "width": ...}
+    или просто список. Отвечает сразу (202) номером пачки; прогресс - GET /prewarm/<id>.
+    """
+    req_logger = logging.getLogger(threading.current_thread().name)
+    payload = request.get_json(silent=True)
+    if isinstance(payload, list):
+        payload = {"texts": payload}
+    if not isinstance(payload, dict) or not isinstance(payload.get("texts"), list):
+        return error_response('Ожидается JSON {"texts": ["...", ...]}', 400)
+    texts = [text.strip() for text in payload["texts"] if isinstance(text, str) and text.strip()]
+    if not texts:
+        return error_response("Список текстов пуст", 400)
+    if len(texts) > BATCH_MAX_TEXTS:
+        return error_response(f"Слишком много текстов в пачке (максимум {BATCH_MAX_TEXTS})", 413)
+    format_args = dict(request.args.items())
+    format_args.update({key: payload[key] for key in ('format', 'rate', 'width') if payload.get(key)})
+    try:
+        audio_format = parse_audio_format(format_args, req_logger)
+    except RequestError as e:
+        return error_response(e.message, e.status)
+    batch = prewarm_queue.submit(texts, audio_format, "api")
+    req_logger.info(f"Пачка {batch.id}: {batch.total} текстов поставлено в фоновый синтез ({audio_format.key}).")
+    return jsonify({"status": "accepted", "batch_id": batch.id, "total": batch.total,
+                    "status_url": f"/prewarm/{batch.id}"}), 202
+
+@app.route('/prewarm/status', methods=['GET'])
+def handle_prewarm_status():
+    return jsonify(prewarm_queue.stats())
+
+@app.route('/prewarm/<batch_id>', methods=['GET'])
+def handle_prewarm_batch(batch_id):
+    batch = prewarm_queue.get(batch_id)
+    if batch is None:
+        return error_response("Пачка не найдена", 404)
+    return jsonify(batch.to_dict())
+
+@app.route('/jobs', methods=['POST'])
+def handle_create_jobs():
+    """
+    Ставит синтез в работу и сразу отвечает (202): JSON {"text": "..."} или {"texts": [...]},
+    плюс format/rate/width. Статус - GET /jobs/<id>, аудио - GET /jobs/<id>/audio,
+    завершения - поток событий GET /jobs/events?ids=...
+    """
+    req_logger = logging.getLogger(threading.current_thread().name)
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        return error_response('Ожидается JSON {"text": "..."} или {"texts": [...]}', 400)
+    texts = payload.get("texts") if isinstance(payload.get("texts"), list) else [payload.get("text")]
+    texts = [text.strip() for text in texts if isinstance(text, str) and text.strip()]
+    if not texts:
+        return error_response("Текст не предоставлен", 400)
+    if len(texts) > BATCH_MAX_TEXTS:
+        return error_response(f"Слишком много текстов (максимум {BATCH_MAX_TEXTS})", 413)
+    format_args = dict(request.args.items())
+    format_args.update({key: payload[key] for key in ('format', 'rate', 'width') if payload.get(key)})
+    try:
+        audio_format = parse_audio_format(format_args, req_logger)
+        check_telegram_ready(req_logger)
+    except RequestError as e:
+        return error_response(e.message, e.status)
+    if pending_requests.full:
+        metrics.REJECTED.inc("pending_full")
+        return error_response("Сервер перегружен, повторите запрос позже", 503, OVERLOAD_RETRY_AFTER)
+    try:
+        jobs = job_store.submit(texts, audio_format, telegram_loop, request.remote_addr)
+    except TooManyJobs as e:
+        metrics.REJECTED.inc("jobs")
+        req_logger.warning(f"Задания от {request.remote_addr} отклонены: {e}")
+        return error_response(str(e), 503, OVERLOAD_RETRY_AFTER)
+    req_logger.info(f"Создано заданий: {len(jobs)} ({audio_format.key}).")
+    return jsonify({"status": "accepted", "jobs": [job.to_dict() for job in jobs],
+                    "events_url": "/jobs/events?ids=" + ",".join(job.id for job in jobs)}), 202
+
+def job_event_ids(args):
+    return [job_id for job_id in args.get('ids', '').split(',') if job_id]
+
+@app.route('/jobs/events', methods=['GET'])
+def handle_job_events():
+    """Server-Sent Events о завершении заданий (все или только ?ids=...)."""
+    return Response(job_store.iter_events(job_event_ids(request.args), SSE_KEEPALIVE, SSE_MAX_LIFETIME),
+                    mimetype="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def handle_job_status(job_id):
+    job = job_store.get(job_id)
+    if job is None:
+        return error_response("Задание не найдено", 404)
+    return jsonify(job.to_dict())
+
+@app.route('/jobs/<job_id>/audio', methods=['GET'])
+def handle_job_audio(job_id):
+    """Аудио завершённого задания - как у /synthesize/: base64, с ?stream=1 - бинарно."""
+    job = job_store.get(job_id)
+    if job is None:
+        return error_response("Задание не найдено", 404)
+    if job.state == STATE_ERROR:
+        return error_response(f"Ошибка обработки: {job.error}", 500)
+    if not job.finished:
+        return error_response("Задание ещё выполняется", 409)
+    audio_data = audio_cache.get(job.cache_key)
+    if audio_data is None:
+        return error_response("Аудио задания уже вытеснено из кэша, создайте задание заново", 410)
+    return audio_response(audio_data, job.audio_format, wants_stream(request.args))
+
+
+def use_async_http():
+    return HTTP_SERVER == "async" and AIOHTTP_AVAILABLE
+
+
+async def run_async_http():
+    """Асинхронный сервер: /synthesize/ - корутина, остальные маршруты - через Flask."""
+    @web.middleware
+    async def count_responses(http_request, handler):
+        start = time.perf_counter()
+        response = await handler(http_request)
+        if is_synthesize_path(http_request.path):
+            observe_response(response.status, time.perf_counter() - start)
+        return response
+
+    @web.middleware
+    async def release_admission_async(http_request, handler):
+        try:
+            return await handler(http_request)
+        finally:
+            client = http_request.get("admitted_client")
+            if client is not None:
+                admission.release(client)
+
+    async def handle_job_events_async(http_request):
+        # Через WSGI-мост поток событий не пройдёт: мост собирает ответ целиком
+        return await event_stream_response(http_request, job_store.aiter_events(job_event_ids(http_request.query), SSE_KEEPALIVE, SSE_MAX_LIFETIME))
+
+    routes = [
+        web.get('/synthesize/', handle_synthesize_async),
+        web.get('/synthesize/{text:.*}', handle_synthesize_async),
+        web.get('/jobs/events', handle_job_events_async),
+    ]
+    return await start_async_http_server(routes, FLASK_HOST, FLASK_PORT, fallback_wsgi_app=app.wsgi_app,
+                                         middlewares=[count_responses, release_admission_async])
+
+
+# --- Логика Pyrogram ---
+async def send_text_to_bot(text_to_send, priority=PRIORITY_INTERACTIVE, on_sent=None, voice=None, timeout=None):
+    """
+    Отправляет текст боту через наименее загруженную готовую сессию и возвращает id
+    сообщения. on_sent(имя сессии, id сообщения, голос) вызывается сразу после отправки.
+    timeout - сколько ждать в очереди отправки (время переключения голоса не считается);
+    не дождались - asyncio.TimeoutError.
+    """
+    pyro_logger = logging.getLogger("PyrogramClient")
+    if not session_pool.sessions:
+        pyro_logger.error("Нет ни одной сессии Pyrogram для отправки.")
+        return None
+    for attempt in range(3):
+        session = session_pool.pick(voice)
+        if session:
+            break
+        pyro_logger.warning(f"Ни одна сессия не готова (переподключение), ждём... (попытка {attempt + 1}/3)")
+        await asyncio.sleep(5)
+    else:
+        pyro_logger.error("Ни одна сессия не подключилась после ожидания.")
+        return None
+    try:
+        # Очередь отправки сессии сама соблюдает темп и паузы FloodWait
+        return await session.scheduler.send(
+            text_to_send, priority,
+            on_sent=(lambda message_id, sent_voice: on_sent(session.name, message_id, sent_voice)) if on_sent else None,
+            voice=voice, timeout=timeout)
+    except asyncio.TimeoutError:
+        raise
+    except Exception as e:
+        pyro_logger.error(f"Ошибка при отправке боту {TARGET_BOT_USERNAME} (сессия {session.name}): {e}")
+        return None
+
+async def dispatch_pending_request(request_data, priority=PRIORITY_INTERACTIVE, timeout=None):
+    """
+    Отправляет текст запроса боту и привязывает запрос к id отправленного сообщения.
+    Привязка выполняется очередью отправки сразу после send_message, поэтому ответ
+    бота не может прийти в handle_voice_message раньше, чем запрос появится в таблице.
+    """
+    start = time.time()
+    with metrics.STAGE_SECONDS.time("telegram_send"):
+        message_id = await send_text_to_bot(request_data.text, priority,
+                                            on_sent=lambda session_name, message_id, sent_voice: pending_requests.bind_message_id(request_data, message_id, session_name, sent_voice),
+                                            voice=request_data.voice, timeout=timeout)
+    # Фоновые сообщения ждут в очереди за интерактивными - для таймаута отправки не показательны
+    if message_id and priority == PRIORITY_INTERACTIVE:
+        send_latency.observe(0, time.time() - start)
+    return message_id
+
+async def synthesize_chunk_async(text, audio_format, priority=PRIORITY_INTERACTIVE, voice=None):
+    """
+    Синтез одного куска длинного текста в цикле событий Telegram: кэш, затем тот же
+    single-flight, что и у обычных запросов, поэтому повторяющиеся куски не уходят
+    боту дважды. Возвращает (аудио в audio_format, голос, которым оно озвучено).
+    Фоновые сообщения могут долго стоять в очереди за интерактивными, поэтому
+    таймаут отправки для них не действует.
+    """
+    chunk_logger = logging.getLogger("Chunks")
+    loop = asyncio.get_running_loop()
+    cache_key = make_cache_key(text, audio_format.key, voice)
+    cached_audio = await loop.run_in_executor(None, audio_cache.get, cache_key)
+    if cached_audio:
+        return cached_audio, voice
+
+    request_data, is_owner = acquire_pending(text, audio_format, chunk_logger, voice)
+    try:
+        if is_owner:
+            try:
+                timeout = send_timeout() if priority == PRIORITY_INTERACTIVE else None
+                message_id = await dispatch_pending_request(request_data, priority, timeout)
+                if not message_id:
+                    raise Exception("Не удалось отправить сообщение боту.")
+            except Exception as e:
+                error = send_error(e, chunk_logger)
+                pending_requests.complete(request_data, error=error)
+                raise error from e
+        await asyncio.wait_for(pending_requests.wait_async(request_data), response_timeout(text))
+        check_result(request_data, chunk_logger)
+        audio_data = request_data.result.get(audio_format.key)
+        if audio_data is None:
+            with metrics.STAGE_SECONDS.time("convert"):
+                audio_data = await convert_in_pool(request_data.result[OGG_PASSTHROUGH.key], audio_format)
+        await loop.run_in_executor(None, audio_cache.put, result_cache_key(request_data, audio_format), audio_data)
+        return audio_data, request_data.sent_voice
+    finally:
+        pending_requests.release(request_data)
+
+async def synthesize_chunks_async(text, chunks, audio_format, priority=PRIORITY_INTERACTIVE, voice=None):
+    """
+    Отправляет все куски сразу, ответы сопоставляются по id сообщений; аудио склеивается
+    по порядку и кладётся в кэш под текстом text, если все куски озвучены одним голосом.
+    Возвращает (аудио, ключ кэша; None - голоса кусков различаются и аудио не кэшировано).
+    """
+    parts = await asyncio.gather(*(synthesize_chunk_async(chunk, audio_format, priority, voice) for chunk in chunks))
+    loop = asyncio.get_running_loop()
+    audio_data = await loop.run_in_executor(None, concat_audio, [audio for audio, _ in parts], audio_format, CHUNK_SILENCE_MS)
+    sent_voices = {sent_voice for _, sent_voice in parts}
+    if len(sent_voices) != 1:
+        return audio_data, None
+    cache_key = make_cache_key(text, audio_format.key, sent_voices.pop())
+    await loop.run_in_executor(None, audio_cache.put, cache_key, audio_data)
+    return audio_data, cache_key
+
+async def synthesize_text_async(text, audio_format, priority, req_logger, voice=None):
+    """
+    Полный синтез текста в цикле событий Telegram для фоновых пачек и заданий: та же
+    нормализация, ключ кэша и деление на куски, что у /synthesize/.
+    Возвращает (аудио, было ли оно уже в кэше, ключ кэша; None - аудио не кэшировано).
+    """
+    loop = asyncio.get_running_loop()
+    voice = session_pool.resolve_voice(voice)
+    text_to_send_to_bot = await loop.run_in_executor(None, normalize_text, text, req_logger)
+    cache_key = make_cache_key(text_to_send_to_bot, audio_format.key, voice)
+    cached_audio = await loop.run_in_executor(None, audio_cache.get, cache_key)
+    if cached_audio:
+        return cached_audio, True, cache_key
+    check_telegram_ready(req_logger)
+    chunks = split_for_bot(text_to_send_to_bot, audio_format)
+    if len(chunks) > 1:
+        audio_data, cache_key = await synthesize_chunks_async(text_to_send_to_bot, chunks, audio_format, priority, voice)
+    else:
+        # Кусок сам кладёт аудио в кэш - под голосом, которым его озвучил бот
+        audio_data, sent_voice = await synthesize_chunk_async(text_to_send_to_bot, audio_format, priority, voice)
+        cache_key = make_cache_key(text_to_send_to_bot, audio_format.key, sent_voice)
+    return audio_data, False, cache_key
+
+async def synthesize_background(text, audio_format, req_logger):
+    """
+    synthesize_text_async с фоновым приоритетом отправки - для пачек и заданий, которых
+    клиент не ждёт на открытом соединении. Возвращает то же, что synthesize_text_async.
+    """
+    while True:
+        try:
+            return await synthesize_text_async(text, audio_format, PRIORITY_BACKGROUND, req_logger,
+                                               DEFAULT_VOICE_SETTING)
+        except RequestError as e:
+            if e.status != 503 or not e.retry_after:
+                raise
+            # Таблица ожидания заполнена: фоновый синтез уступает место интерактивным запросам
+            await asyncio.sleep(e.retry_after)
+
+async def prewarm_text(text, audio_format):
+    """Фоновый синтез фразы в кэш (для prewarm_queue). True - аудио уже было в кэше."""
+    _, cached, _ = await synthesize_background(text, audio_format, logging.getLogger("Prewarm"))
+    return cached
+
+async def synthesize_job(text, audio_format):
+    """
+    Синтез для задания POST /jobs - в фоновой очереди: интерактивные запросы отправляются первыми.
+    Аудио остаётся только в кэше; возвращает (ключ кэша, размер) для JobStore.
+    """
+    audio_data, _, cache_key = await synthesize_background(text, audio_format, logging.getLogger("Jobs"))
+    if cache_key is None:
+        # Куски озвучены разными голосами - под ключом текста не кэшируется, нужен ключ задания
+        cache_key = make_cache_key(uuid.uuid4().hex, audio_format.key)
+        await asyncio.get_running_loop().run_in_executor(None, audio_cache.put, cache_key, audio_data)
+    return cache_key, len(audio_data)
+
+# Очередь фонового синтеза (POST /synthesize/batch и PREWARM_FILE); запускается в main_telegram_logic
+prewarm_queue = PrewarmQueue(prewarm_text, PREWARM_WORKERS)
+metrics.gauge_callback("tts_prewarm_queue_depth", "Фразы в очереди фонового синтеза", lambda: prewarm_queue.queued)
+
+# Асинхронные задания POST /jobs (результат по id или через /jobs/events)
+job_store = JobStore(synthesize_job, JOB_TTL, JOBS_MAX, JOBS_MAX_PER_CLIENT)
+metrics.gauge_callback("tts_jobs_running", "Выполняющиеся задания POST /jobs", lambda: job_store.running)
+
+async def get_bot_id(session):
+    # id бота (peer) у каждого аккаунта свой
+    main_logger = logging.getLogger(__name__)
+    if not session.connected:
+        main_logger.warning(f"Клиент сессии '{session.name}' не готов для получения ID бота.")
+        return
+    saved_id = bot_ids.get(session.name, {}).get(TARGET_BOT_USERNAME)
+    if saved_id:
+        try:
+            # Пир с известным id берётся из хранилища сессии Pyrogram, без поиска по имени
+            await session.client.resolve_peer(saved_id)
+            session.bot_id = saved_id
+            main_logger.info(f"ID для бота {TARGET_BOT_USERNAME} взят из {BOT_IDS_FILE}: {saved_id} (сессия '{session.name}')")
+            return
+        except Exception as e:
+            main_logger.warning(f"Сохранённый ID бота для сессии '{session.name}' не подошёл ({e}), ищем заново.")
+    main_logger.info(f"Попытка получить ID для @{TARGET_BOT_USERNAME} (сессия '{session.name}')")
+    try:
+        user = await session.client.get_users(TARGET_BOT_USERNAME)
+        if user:
+            session.bot_id = user.id
+            main_logger.info(f"ID для бота {TARGET_BOT_USERNAME} определен: {session.bot_id}")
+            bot_ids.setdefault(session.name, {})[TARGET_BOT_USERNAME] = user.id
+            save_bot_ids(BOT_IDS_FILE, bot_ids)
+        else:
+            main_logger.error(f"Не удалось найти пользователя/бота с username {TARGET_BOT_USERNAME}")
+            session.bot_id = None
+    except Exception as e:
+        main_logger.error(f"Не удалось получить ID для бота {TARGET_BOT_USERNAME}: {e}")
+        session.bot_id = None
+
+
+async def handle_bot_reply(session_name, reply_id, download, file_unique_id=None):
+    """
+    Обработка голосового ответа бота на сообщение reply_id: download() возвращает байты
+    OGG, file_unique_id - постоянный id файла в Telegram (см. fetch_voice_audio).
+    Вызывается обработчиком Pyrogram и заглушкой бота (mock_bot.py).
+    """
+    global pending_requests
+    pyro_logger = logging.getLogger("PyrogramHandler")
+    request_data = pending_requests.get_by_message_id(reply_id, session_name)
+    if not request_data:
+         late_request = pending_requests.pop_late(reply_id, session_name)
+         if late_request:
+             await salvage_late_reply(late_request, download, file_unique_id, pyro_logger)
+             return
+         pyro_logger.warning(f"Получено аудио в ответ на сообщение {reply_id}, но соответствующий активный запрос не найден в pending_requests.")
+         return
+    request_key = request_data.text
+    pyro_logger.info(f"Ответ на сообщение {reply_id} с текстом: '{request_key}'")
+    if request_data.done:
+         pyro_logger.warning(f"Запрос '{request_key}' уже имеет результат/ошибку.")
+         return
+    if request_data.sent_at:
+        observe_bot_wait(request_data)
+
+    audio_result_data = None
+    error_occurred = None
+    try:
+        audio_result_data = await fetch_voice_audio(request_data, download, file_unique_id,
+                                                    pending_requests.requested_formats(request_data), pyro_logger)
+    except Exception as e:
+        pyro_logger.error(f"Ошибка при обработке голосового сообщения для '{request_key}': {e}", exc_info=True)
+        error_occurred = e
+
+    if pending_requests.complete(request_data, result=audio_result_data, error=error_occurred):
+        pyro_logger.info(f"Результат записан для '{request_key}', ожидающие разбужены.")
+    else:
+        pyro_logger.warning(f"Попытка записать результат/ошибку для '{request_key}', но он уже установлен.")
+
+
+async def fetch_voice_audio(request_data, download, file_unique_id, formats, pyro_logger):
+    """
+    Аудио голосового бота: {ключ формата: байты} - OGG и все formats. Бот присылает
+    тот же файл (тот же file_unique_id) на повторяющийся текст; если такой файл уже
+    обрабатывался и его аудио ещё в кэше, скачивание и конвертация пропускаются.
+    """
+    request_key = request_data.text
+    audio_result_data = await load_known_voice(file_unique_id, formats)
+    if audio_result_data:
+        metrics.VOICE_REUSED.inc("download")
+        pyro_logger.info(f"Голосовое {file_unique_id} уже обрабатывалось, аудио для '{request_key}' взято из кэша.")
+    else:
+        pyro_logger.info(f"Скачивание OGG для '{request_key}' в память")
+        with metrics.STAGE_SECONDS.time("download"):
+            ogg_bytes = await download()
+        pyro_logger.info(f"OGG скачано успешно ({len(ogg_bytes)} байт).")
+        audio_result_data = {OGG_PASSTHROUGH.key: ogg_bytes}
+        await remember_voice(file_unique_id, request_data, ogg_bytes)
+
+    ogg_bytes = audio_result_data[OGG_PASSTHROUGH.key]
+    for audio_format in formats:
+        if audio_format.key in audio_result_data:
+            continue
+        pyro_logger.info(f"Конвертация в {audio_format.key}")
+        try:
+            with metrics.STAGE_SECONDS.time("convert"):
+                audio_result_data[audio_format.key] = await convert_in_pool(ogg_bytes, audio_format)
+        except Exception as convert_err:
+            pyro_logger.error(f"Ошибка конвертации OGG в {audio_format.key}: {convert_err}", exc_info=True)
+            raise
+        pyro_logger.info(f"Аудио для '{request_key}' сконвертировано в {audio_format.key} ({len(audio_result_data[audio_format.key])} байт).")
+    return audio_result_data
+
+
+async def load_known_voice(file_unique_id, formats):
+    """
+    Аудио уже обработанного файла из кэша: OGG и те из formats, что там есть.
+    Пустой словарь - файл не встречался или его OGG вытеснен из кэша.
+    """
+    known = voice_index.get(file_unique_id) if file_unique_id else None
+    if known is None:
+        return {}
+    known_text, known_voice = known
+    loop = asyncio.get_running_loop()
+    ogg_bytes = await loop.run_in_executor(None, audio_cache.get, make_cache_key(known_text, OGG_PASSTHROUGH.key, known_voice))
+    if ogg_bytes is None:
+        return {}
+    audio_result_data = {OGG_PASSTHROUGH.key: ogg_bytes}
+    for audio_format in formats:
+        if audio_format.key in audio_result_data:
+            continue
+        audio_data = await loop.run_in_executor(None, audio_cache.get, make_cache_key(known_text, audio_format.key, known_voice))
+        if audio_data is not None:
+            audio_result_data[audio_format.key] = audio_data
+            metrics.VOICE_REUSED.inc("convert")
+    return audio_result_data
+
+
+async def remember_voice(file_unique_id, request_data, ogg_bytes):
+    """Запоминает скачанный файл: OGG - в кэш под текстом и голосом запроса, их - в voice_index."""
+    if not file_unique_id:
+        return
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, audio_cache.put, make_cache_key(request_data.text, OGG_PASSTHROUGH.key, request_data.sent_voice), ogg_bytes)
+    voice_index.put(file_unique_id, request_data.text, request_data.sent_voice)
+
+
+def observe_bot_wait(request_data):
+    bot_wait = time.time() - request_data.sent_at
+    metrics.STAGE_SECONDS.observe("bot_wait", bot_wait)
+    bot_latency.observe(len(request_data.text), bot_wait)
+
+
+async def salvage_late_reply(request_data, download, file_unique_id, pyro_logger):
+    """
+    Голосовое пришло, когда ожидающие уже ушли по таймауту: текст оплачен, поэтому
+    аудио всё равно скачивается и кладётся в кэш - в запрошенных форматах и в формате
+    по умолчанию (потоковые запросы ждали OGG и свой формат не оставили).
+    """
+    request_key = request_data.text
+    observe_bot_wait(request_data)  # иначе оценка задержки занижалась бы на медленных ответах
+    pyro_logger.info(f"Опоздавший ответ для '{request_key}', сохраняем в кэш.")
+    loop = asyncio.get_running_loop()
+    try:
+        formats = {audio_format.key: audio_format for audio_format in pending_requests.requested_formats(request_data)}
+        formats.setdefault(DEFAULT_AUDIO_FORMAT.key, DEFAULT_AUDIO_FORMAT)
+        audio_result_data = await fetch_voice_audio(request_data, download, file_unique_id,
+                                                    list(formats.values()), pyro_logger)
+        for format_key, audio_data in audio_result_data.items():
+            await loop.run_in_executor(None, audio_cache.put, make_cache_key(request_key, format_key, request_data.sent_voice), audio_data)
+        metrics.LATE_REPLIES.inc()
+    except Exception as e:
+        pyro_logger.error(f"Не удалось сохранить опоздавший ответ для '{request_key}': {e}")
+
+
+def setup_pyrogram_handlers(client, session_name):
+    pyro_logger = logging.getLogger("PyrogramHandler")
+    @client.on_message(filters.private & filters.user(TARGET_BOT_USERNAME) & filters.voice)
+    async def handle_voice_message(client, message):
+        pyro_logger.info(f"Получено голосовое сообщение от бота {TARGET_BOT_USERNAME} (сессия '{session_name}')")
+        reply_id = message.reply_to_message_id or (message.reply_to_message.id if message.reply_to_message else None)
+        if not reply_id:
+            pyro_logger.warning("Не удалось определить исходное сообщение (reply_to_message отсутствует). Игнорирование.")
+            return
+
+        async def download():
+            ogg_buffer = await message.download(in_memory=True)
+            return ogg_buffer.getvalue()
+
+        await handle_bot_reply(session_name, reply_id, download, message.voice.file_unique_id)
+
+
+# --- Функции запуска ---
+def run_flask():
+    main_logger = logging.getLogger(__name__)
+    main_logger.info(f"Запуск Flask сервера на http://{FLASK_HOST}:{FLASK_PORT}")
+    app.run(host=FLASK_HOST, port=FLASK_PORT, threaded=True, use_reloader=False)
+
+async def sweep_pending_requests():
+    """Периодически удаляет из таблицы ожидания записи, которые никто не снял."""
+    sweep_logger = logging.getLogger("PendingSweeper")
+    while True:
+        await asyncio.sleep(PENDING_SWEEP_INTERVAL)
+        removed = pending_requests.sweep(PENDING_TTL)
+        if removed:
+            sweep_logger.warning(f"Из таблицы ожидания удалено {removed} устаревших записей (старше {PENDING_TTL} сек).")
+
+def add_mock_sessions():
+    """TTS_BACKEND=mock: вместо аккаунтов Telegram - заглушки бота с теми же очередями отправки."""
+    main_logger = logging.getLogger(__name__)
+    voice = load_voice(MOCK_BOT_VOICE, MOCK_BOT_VOICE_MS)
+    for session_name in SESSION_NAMES:
+        session_pool.add(MockBotSession(session_name, handle_bot_reply, voice, SEND_RATE, SEND_BURST,
+                                        latency_ms=MOCK_BOT_LATENCY_MS, latency_sigma=MOCK_BOT_LATENCY_SIGMA,
+                                        drop_rate=MOCK_BOT_DROP_RATE))
+    main_logger.warning(f"Режим заглушки бота: {len(SESSION_NAMES)} сессий, медиана ответа {MOCK_BOT_LATENCY_MS:.0f} мс.")
+
+async def start_session(session):
+    """Подключение одной сессии; ошибка одной сессии не мешает работать остальным."""
+    main_logger = logging.getLogger(__name__)
+    if HEADLESS and not os.path.exists(f"{session.name}.session"):
+        # Вход требует ввода телефона и кода - без консоли это невозможно
+        main_logger.error(f"Сессия '{session.name}' не авторизована. Запустите скрипт один раз в консоли, чтобы войти.")
+        return
+    try:
+        await session.client.start()
+        # Pyrogram заполняет client.me при запуске; get_me - только если его нет
+        user_info = getattr(session.client, "me", None) or await session.client.get_me()
+        main_logger.info(f"Сессия '{session.name}': вход выполнен как {user_info.first_name} (@{user_info.username}) ID: {user_info.id}")
+        await get_bot_id(session)
+        if not session.bot_id:
+            main_logger.warning(f"Не удалось определить ID бота {TARGET_BOT_USERNAME} для сессии '{session.name}'.")
+    except Exception as e:
+        main_logger.exception(f"Ошибка при запуске сессии '{session.name}': {e}")
+
+async def main_telegram_logic():
+    main_logger = logging.getLogger(__name__)
+    global telegram_loop
+    if TTS_BACKEND != "mock" and (not API_ID or not API_HASH):
+        main_logger.error("API_ID и API_HASH должны быть установлены (в окружении или в .env)!")
+        return
+    telegram_loop = asyncio.get_running_loop()
+    asyncio.create_task(sweep_pending_requests())
+    http_runner = None
+    if use_async_http():
+        http_runner = await run_async_http()
+    if TTS_BACKEND == "mock":
+        add_mock_sessions()
+    else:
+        for session_name in SESSION_NAMES:
+            main_logger.info(f"Инициализация клиента Pyrogram с сессией '{session_name}'...")
+            client = Client(session_name, api_id=int(API_ID), api_hash=API_HASH, workers=4)
+            setup_pyrogram_handlers(client, session_name)
+            session_pool.add(TelegramSession(session_name, client, SEND_RATE, SEND_BURST,
+                                            VOICE_COMMAND, SPEED_COMMAND))
+    for hook in startup_hooks:
+        asyncio.create_task(hook())
+    try:
+        # Сессии подключаются одновременно (Mystem в это время запускается в своём потоке)
+        await asyncio.gather(*(start_session(session) for session in session_pool.sessions
+                               if not isinstance(session, MockBotSession)))
+        ready = len(session_pool.ready_sessions())
+        main_logger.info(f"Pyrogram готов: сессий {ready} из {len(session_pool.sessions)}. Ожидание...")
+        prewarm_queue.start(telegram_loop)
+        if PREWARM_FILE:
+            try:
+                phrases = read_phrases(PREWARM_FILE)
+                prewarm_queue.submit(phrases, DEFAULT_AUDIO_FORMAT, "file")
+                main_logger.info(f"Прогрев кэша: {len(phrases)} фраз из {PREWARM_FILE} поставлено в фоновый синтез.")
+            except OSError as e:
+                main_logger.error(f"Не удалось прочитать файл фраз {PREWARM_FILE}: {e}")
+        await asyncio.Future()
+    except Exception as e:
+        main_logger.exception(f"Критическая ошибка при запуске или работе Pyrogram: {e}")
+    finally:
+        for session in session_pool.sessions:
+            if session.connected:
+                main_logger.info(f"Остановка клиента Pyrogram '{session.name}'...")
+                await session.client.stop()
+        main_logger.info("Клиенты Pyrogram остановлены.")
+        if http_runner:
+            await http_runner.cleanup()
+
+
+# --- Точка входа ---
+def main():
+    """Запуск сервера: HTTP (Flask в потоке или aiohttp в цикле событий) и сессии Telegram."""
+    main_logger = logging.getLogger(__name__)
+    if HTTP_SERVER == "async" and not AIOHTTP_AVAILABLE:
+        main_logger.error("HTTP_SERVER=async, но пакет aiohttp не установлен. Используется Flask.")
+    # Mystem запускается параллельно с HTTP-сервером и Telegram; готовность - GET /readyz
+    threading.Thread(target=warm_up_mystem, name="MystemWarmup", daemon=True).start()
+    if not use_async_http():
+        flask_thread = threading.Thread(target=run_flask, name="FlaskThread", daemon=True)
+        flask_thread.start()
+    try:
+        main_logger.info("Запуск основного цикла Telegram (asyncio)...")
+        asyncio.run(main_telegram_logic())
+    except KeyboardInterrupt:
+        main_logger.info("Получен сигнал KeyboardInterrupt (Ctrl+C). Завершение работы...")
+    except Exception as e:
+        main_logger.exception(f"Непредвиденная ошибка в главном потоке: {e}")
+    finally:
+        main_logger.info("Скрипт завершает работу.")
@@ -0,0 +1,84 @@
+# --- Голос и скорость озвучки ---
+# Голос и скорость - настройка чата с ботом, а не параметр сообщения: бот озвучивает
+# текст тем голосом, который выбран командой раньше. Поэтому запрос с голосом требует
+# определённого состояния чата. Очередь отправки (send_scheduler.py) помнит текущее
+# состояние, отправляет команды переключения, только если оно другое, и отправляет
+# подряд сообщения с одним голосом, чтобы переключаться реже.
+
+import re
+from collections import namedtuple
+
+# Имя голоса подставляется в команду боту, поэтому допускаются только простые имена
+VOICE_NAME_RE = re.compile(r"^[A-Za-z0-9_-]{1,32}$")
+MIN_SPEED = 0.25
+MAX_SPEED = 4.0
+
+# Команды переключения по умолчанию ({voice}, {speed} - значения)
+VOICE_COMMAND = "/speaker {voice}"
+SPEED_COMMAND = "/speed {speed}"
+
+
+class VoiceSetting(namedtuple("VoiceSetting", ("voice", "speed"))):
+    """Требуемые голос и скорость; None в поле - подходит любое значение."""
+    __slots__ = ()
+
+    def satisfied_by(self, current):
+        """Подходит ли текущее состояние чата current (None - неизвестно)."""
+        if current is None:
+            return False
+        return (self.voice is None or self.voice == current.voice) and \
+               (self.speed is None or self.speed == current.speed)
+
+    def merged(self, current):
+        """Состояние чата после переключения на эту настройку из current."""
+        if current is None:
+            return self
+        return VoiceSetting(self.voice or current.voice, self.speed or current.speed)
+
+    def __str__(self):
+        # Часть ключа кэша (audio_cache.make_cache_key)
+        return f"{self.voice or ''}@{self.speed or ''}"
+
+
+def resolve_voice(requested, current):
+    """
+    Настройка, которой бот озвучит текст с требованием requested при состоянии чата
+    current: незаданное берётся из current. None - требований нет, а состояние неизвестно.
+    Ключ кэша строится по ней, а не по requested: иначе аудио с голосом чата попало бы
+    под ключ без голоса.
+    """
+    if requested is None:
+        return current
+    return requested.merged(current)
+
+
+def parse_voice_setting(voice, speed, allowed_voices=()):
+    """VoiceSetting из параметров запроса или None, если не задано ни то, ни другое. ValueError - неверные значения."""
+    voice = (voice or "").strip() or None
+    speed = (str(speed).strip() if speed is not None else "") or None
+    if voice is not None:
+        if not VOICE_NAME_RE.match(voice):
+            raise ValueError(f"Недопустимое имя голоса: {voice}")
+        if allowed_voices and voice not in allowed_voices:
+            raise ValueError(f"Неизвестный голос: {voice} (доступны: {', '.join(allowed_voices)})")
+    if speed is not None:
+        try:
+            speed_value = float(speed)
+        except ValueError:
+            raise ValueError(f"Неверная скорость: {speed}")
+        if not MIN_SPEED <= speed_value <= MAX_SPEED:
+            raise ValueError(f"Скорость должна быть от {MIN_SPEED} до {MAX_SPEED}")
+        speed = f"{speed_value:g}"
+    if voice is None and speed is None:
+        return None
+    return VoiceSetting(voice, speed)
+
+
+def switch_commands(target, current, voice_command=VOICE_COMMAND, speed_command=SPEED_COMMAND):
+    """Команды боту, которые переводят чат из состояния current в target."""
+    commands = []
+    if target.voice is not None and (current is None or current.voice != target.voice):
+        commands.append(voice_command.format(voice=target.voice))
+    if target.speed is not None and (current is None or current.speed != target.speed):
+        commands.append(speed_command.format(speed=target.speed))
+    return commands